@@ -0,0 +1,494 @@
+# Benchmark: a whole executor job, offline.
+#
+# Runs JobExecutor.execute() against local stand-ins for everything it talks to: an HTTP server playing
+# the Runway app (init, job, status, error, summary, unmatchedIds, outputFiles, and the EDU roster), a
+# disk-backed S3 server reached through S3_ENDPOINT_URL, a local git remote for the bundles repo, and
+# the stub `earthmover` and `lightbeam` commands in benchmarks/stubs. Input files and rosters are
+# synthetic and generated at each requested scale.
+#
+# By default the job sends to an ODS whose roster is missing some students, so the cross-year pass runs
+# as well. Each job runs in a fresh process so its peak memory is its own; the stand-in servers run in
+# processes of their own too. Per-action metrics come from the job's timings.json, alongside time spent
+# in executor methods that are regression-prone but not actions of their own.
+#
+#   PYTHONPATH=. python benchmarks/end_to_end.py [--rows 10000 100000 ...] [--output results.json]
+#       [--baseline previous-results.json]
+#
+# With --baseline, the script exits non-zero if anything measured got meaningfully slower or bigger.
+
+import argparse
+import email.utils
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+DEFAULT_ROWS = [10_000, 100_000]
+STUBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+BUCKET = "bench-bucket"
+JOB_PREFIX = "jobs/bench"
+BUNDLE_PATH = "assessments/BENCH"
+# executor methods timed in addition to the actions in timings.json
+TIMED_METHODS = [
+    "unpack_id_types",
+    "check_input_encoding",
+    "earthmover_run",
+    "cross_year_pass",
+    "get_roster_from_edu",
+    "upload_output",
+    "upload_artifact",
+]
+# a regression must be worse than the baseline by this factor, and by at least the absolute slack
+MAX_REGRESSION_RATIO = 1.25
+REGRESSION_SLACK_SECONDS = 0.5
+REGRESSION_SLACK_KB = 16 * 1024
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    """Just enough of the S3 REST API for boto3's get/put/head calls and managed multipart transfers"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse_request_path(self):
+        url = parse.urlsplit(self.path)
+        bucket, _, key = parse.unquote(url.path).lstrip("/").partition("/")
+        return bucket, key, dict(parse.parse_qsl(url.query, keep_blank_values=True))
+
+    def object_path(self, bucket, key):
+        return os.path.join(self.server.root, bucket, parse.quote(key, safe=""))
+
+    def respond(self, code, body=b"", headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def read_body_into(self, path):
+        remaining = int(self.headers.get("Content-Length", 0))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+
+    def not_found(self, key):
+        self.respond(404, f"<Error><Code>NoSuchKey</Code><Key>{key}</Key></Error>".encode(), {"Content-Type": "application/xml"})
+
+    def do_HEAD(self):
+        bucket, key, _ = self.parse_request_path()
+        path = self.object_path(bucket, key)
+        if not os.path.isfile(path):
+            return self.respond(404)
+        stat = os.stat(path)
+        self.send_response(200)
+        self.send_header("Content-Length", str(stat.st_size))
+        self.send_header("ETag", f'"{int(stat.st_mtime_ns)}"')
+        self.send_header("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True))
+        self.end_headers()
+
+    def do_GET(self):
+        bucket, key, _ = self.parse_request_path()
+        path = self.object_path(bucket, key)
+        if not os.path.isfile(path):
+            return self.not_found(key)
+        stat = os.stat(path)
+        start, end = 0, stat.st_size - 1
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            first, _, last = byte_range.removeprefix("bytes=").partition("-")
+            start, end = int(first), min(int(last) if last else end, end)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", f'"{int(stat.st_mtime_ns)}"')
+        self.send_header("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True))
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{stat.st_size}")
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def do_PUT(self):
+        bucket, key, query = self.parse_request_path()
+        if "uploadId" in query:
+            self.read_body_into(os.path.join(self.server.root, ".uploads", query["uploadId"], f"{int(query['partNumber']):05d}"))
+        else:
+            path = self.object_path(bucket, key)
+            self.read_body_into(f"{path}.part")
+            os.replace(f"{path}.part", path)
+        self.respond(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+    def do_POST(self):
+        bucket, key, query = self.parse_request_path()
+        # the request body (the multipart manifest) is not needed; parts are assembled in number order
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            body = (f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                    f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        else:
+            parts_dir = os.path.join(self.server.root, ".uploads", query["uploadId"])
+            path = self.object_path(bucket, key)
+            with open(f"{path}.part", "wb") as out:
+                for part in sorted(os.listdir(parts_dir)):
+                    with open(os.path.join(parts_dir, part), "rb") as f:
+                        shutil.copyfileobj(f, out)
+            os.replace(f"{path}.part", path)
+            shutil.rmtree(parts_dir)
+            body = (f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                    f"<ETag>\"{uuid.uuid4().hex}\"</ETag></CompleteMultipartUploadResult>")
+        self.respond(200, body.encode(), {"Content-Type": "application/xml"})
+
+
+class AppHandler(BaseHTTPRequestHandler):
+    """The app endpoints the executor calls. Every POST is appended to requests.jsonl for inspection"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond_json(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        host, port = self.server.server_address
+        if self.path == "/init":
+            return self.respond_json(200, {"token": "bench-token", "jobUrl": f"http://{host}:{port}/job"})
+        if self.path == "/job":
+            with open(os.path.join(self.server.root, "job.json")) as f:
+                return self.respond_json(200, json.load(f))
+        if self.path == "/roster":
+            path = os.path.join(self.server.root, "edu-roster.jsonl")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Content-Length", str(os.stat(path).st_size))
+            self.end_headers()
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+            return
+        self.respond_json(404, {})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or "null")
+        with self.server.log_lock, open(os.path.join(self.server.root, "requests.jsonl"), "a") as f:
+            f.write(json.dumps({"path": self.path, "body": body}) + "\n")
+        self.respond_json(201, {})
+
+
+def serve(handler_class, root, ports):
+    """Run one stand-in server until the process is terminated, reporting its name and port on ports"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    server.daemon_threads = True
+    server.root = root
+    server.log_lock = threading.Lock()
+    ports.put((handler_class.__name__, server.server_address[1]))
+    server.serve_forever()
+
+
+def student_id(i):
+    return str(100000000 + i)
+
+
+def write_roster(path, num_students, include):
+    """Write a stu-ed-org roster of the students for whom include(i) is true"""
+    with open(path, "w") as f:
+        for i in range(num_students):
+            if not include(i):
+                continue
+            sid = student_id(i)
+            f.write(
+                '{"educationOrganizationReference": {"educationOrganizationId": 255901}, '
+                f'"studentReference": {{"studentUniqueId": "{sid}"}}, '
+                '"studentIdentificationCodes": ['
+                '{"studentIdentificationSystemDescriptor": "uri://ed-fi.org/StudentIdentificationSystemDescriptor#State", '
+                f'"identificationCode": "{sid}"}}, '
+                '{"studentIdentificationSystemDescriptor": "uri://ed-fi.org/StudentIdentificationSystemDescriptor#Local", '
+                f'"identificationCode": "L{i}"}}]}}\n'
+            )
+
+
+def write_input(path, num_rows, encoding):
+    """Write an assessment file with one row per student. Some names are non-ASCII to give encoding detection work"""
+    names = ["Avery", "José", "Zoë", "Mateo", "Chloé", "Noah"]
+    with open(path, "w", encoding=encoding, newline="") as f:
+        f.write("student_id,local_id,first_name,score,test_date\n")
+        for i in range(num_rows):
+            f.write(f"{student_id(i)},L{i},{names[i % len(names)]},{i % 100},2026-05-{i % 28 + 1:02d}\n")
+
+
+def generate_data(data_dir, rows, args):
+    """Generate (or reuse) the input file and rosters for one scale. Returns their paths"""
+    ods_pct = round(args.ods_match * 100)
+    edu_pct = round(args.edu_match * 100)
+    tag = f"{rows}-{args.encoding}-{ods_pct}-{edu_pct}"
+    paths = {
+        "input": os.path.join(data_dir, f"input-{tag}.csv"),
+        "ods_roster": os.path.join(data_dir, f"ods-roster-{tag}.jsonl"),
+        "edu_roster": os.path.join(data_dir, f"edu-roster-{tag}.jsonl"),
+    }
+    if all(os.path.exists(p) for p in paths.values()):
+        return paths
+
+    start = time.monotonic()
+    write_input(paths["input"], rows, args.encoding)
+    # students are spread evenly across the percentiles, so coverage is the same at every scale
+    write_roster(paths["ods_roster"], rows, lambda i: i % 100 < ods_pct)
+    write_roster(paths["edu_roster"], rows, lambda i: i % 100 < edu_pct)
+    print(f"generated {rows} rows of data in {time.monotonic() - start:.1f} s")
+    return paths
+
+
+def make_bundles_remote(workdir):
+    """A local git repository standing in for the bundles repo, cloned to where the executor expects it"""
+    origin = os.path.join(workdir, "bundles-origin")
+    for rel_path in ["packages/student_id_wrapper/earthmover.yaml", f"{BUNDLE_PATH}/earthmover.yaml"]:
+        os.makedirs(os.path.dirname(os.path.join(origin, rel_path)), exist_ok=True)
+        with open(os.path.join(origin, rel_path), "w") as f:
+            f.write("# benchmark stand-in\n")
+    git = ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+    subprocess.run(git + ["-C", origin, "init", "-q", "-b", "main"], check=True)
+    subprocess.run(git + ["-C", origin, "add", "."], check=True)
+    subprocess.run(git + ["-C", origin, "commit", "-q", "-m", "bundles"], check=True)
+    subprocess.run(["git", "clone", "-q", origin, os.path.join(workdir, "bundles")], check=True)
+
+
+def job_definition(app_url, args):
+    return {
+        "appUrls": {
+            "status": f"{app_url}/status",
+            "error": f"{app_url}/error",
+            "unmatchedIds": f"{app_url}/unmatched-ids",
+            "summary": f"{app_url}/summary",
+            "outputFiles": f"{app_url}/output-files",
+            "roster": f"{app_url}/roster",
+        },
+        "sendToOds": True,
+        "crossYearMatchAvailable": not args.no_cross_year,
+        "assessmentDatastore": {"url": "http://ods.invalid", "clientId": "bench", "clientSecret": "bench"},
+        "bundle": {"path": BUNDLE_PATH, "branch": "main"},
+        "appDataBasePath": f"s3://{BUCKET}/{JOB_PREFIX}",
+        "inputFiles": {"INPUT_FILE": "input.csv"},
+        "customDescriptorMappings": {},
+        "inputParams": {"API_YEAR": "2026"},
+    }
+
+
+def run_job(workdir, environ, results):
+    """Run one job in this (fresh) process and put its measurements on results"""
+    os.chdir(workdir)
+    os.environ.update(environ)
+    # artifact paths are resolved when the executor is imported, so that has to happen in the working directory
+    import logging
+    from executor.executor import JobExecutor
+
+    job = JobExecutor()
+    if not environ.get("BENCH_VERBOSE"):
+        logging.getLogger("runway").setLevel(logging.WARNING)
+
+    spans = {}
+    lock = threading.Lock()
+    for name in TIMED_METHODS:
+        def timed(*a, _method=getattr(job, name), _name=name, **kw):
+            start = time.monotonic()
+            try:
+                return _method(*a, **kw)
+            finally:
+                with lock:
+                    calls, seconds = spans.get(_name, (0, 0.0))
+                    spans[_name] = (calls + 1, seconds + time.monotonic() - start)
+        setattr(job, name, timed)
+
+    start = time.monotonic()
+    job.execute()
+    wall_seconds = time.monotonic() - start
+    with open("timings.json") as f:
+        timings = json.load(f)
+    results.put({"wall_seconds": wall_seconds, "timings": timings, "methods": spans})
+
+
+def measure(workdir, environ, rows, paths, app_root, s3_root):
+    """Stage one scale's data where the stand-ins serve it, then run a job against it"""
+    shutil.copyfile(paths["edu_roster"], os.path.join(app_root, "edu-roster.jsonl"))
+    input_key = parse.quote(f"{JOB_PREFIX}/input/input.csv", safe="")
+    os.makedirs(os.path.join(s3_root, BUCKET), exist_ok=True)
+    shutil.copyfile(paths["input"], os.path.join(s3_root, BUCKET, input_key))
+    requests_log = os.path.join(app_root, "requests.jsonl")
+    if os.path.exists(requests_log):
+        os.remove(requests_log)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=run_job, args=(workdir, {**environ, "BENCH_ODS_ROSTER": paths["ods_roster"]}, results))
+    proc.start()
+    result = results.get()
+    proc.join()
+
+    with open(requests_log) as f:
+        posts = [json.loads(line) for line in f]
+    done = [p["body"] for p in posts if p["path"] == "/status" and p["body"]["action"] == "done"]
+    errors = [p["body"] for p in posts if p["path"] == "/error"]
+    result.update({
+        "rows": rows,
+        "input_bytes": os.stat(paths["input"]).st_size,
+        "succeeded": bool(done) and done[-1]["status"] == "success",
+        "error": errors[-1] if errors else None,
+    })
+    return result
+
+
+def report(result):
+    timings = result["timings"]
+    status = "ok" if result["succeeded"] else f"FAILED: {result['error']}"
+    print(f"\n{result['rows']:,} rows ({result['input_bytes'] / 2**20:.1f} MiB input): "
+          f"{result['wall_seconds']:.2f} s, peak RSS {timings['peak_rss_kb'] / 1024:.1f} MiB "
+          f"(children {timings['child_peak_rss_kb'] / 1024:.1f} MiB) - {status}")
+    print(f"  {'action':<24}{'status':>9}{'wall s':>10}{'cpu s':>10}{'child cpu s':>13}{'MiB moved':>11}")
+    for a in timings["actions"]:
+        print(f"  {a['action']:<24}{a['status']:>9}{a['wall_seconds']:>10.2f}{a['cpu_seconds']:>10.2f}"
+              f"{a['child_cpu_seconds']:>13.2f}{a['bytes_transferred'] / 2**20:>11.1f}")
+    print(f"  {'method':<24}{'calls':>9}{'wall s':>10}")
+    for name in TIMED_METHODS:
+        if name in result["methods"]:
+            calls, seconds = result["methods"][name]
+            print(f"  {name:<24}{calls:>9}{seconds:>10.2f}")
+
+
+def regressions(results, baseline):
+    """Descriptions of every measurement that is meaningfully worse than the baseline run at the same scale"""
+    found = []
+    previous_by_rows = {r["rows"]: r for r in baseline}
+    for result in results:
+        previous = previous_by_rows.get(result["rows"])
+        if previous is None:
+            continue
+        pairs = [("job wall seconds", result["wall_seconds"], previous["wall_seconds"], REGRESSION_SLACK_SECONDS),
+                 ("peak RSS KiB", result["timings"]["peak_rss_kb"], previous["timings"]["peak_rss_kb"], REGRESSION_SLACK_KB)]
+        previous_actions = {a["action"]: a for a in previous["timings"]["actions"]}
+        for a in result["timings"]["actions"]:
+            if a["action"] in previous_actions:
+                pairs.append((f"{a['action']} wall seconds", a["wall_seconds"], previous_actions[a["action"]]["wall_seconds"], REGRESSION_SLACK_SECONDS))
+        for name, (_, seconds) in result["methods"].items():
+            if name in previous["methods"]:
+                pairs.append((f"{name} seconds", seconds, previous["methods"][name][1], REGRESSION_SLACK_SECONDS))
+
+        for label, current, before, slack in pairs:
+            if current > before * MAX_REGRESSION_RATIO and current - before > slack:
+                found.append(f"{result['rows']} rows: {label} {before:.2f} -> {current:.2f}")
+    return found
+
+
+def main(args):
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="executor-bench-"))
+    data_dir = os.path.join(workdir, "data")
+    app_root = os.path.join(workdir, "app")
+    s3_root = os.path.join(workdir, "s3")
+    for d in [data_dir, app_root, s3_root]:
+        os.makedirs(d, exist_ok=True)
+    if not os.path.isdir(os.path.join(workdir, "bundles")):
+        make_bundles_remote(workdir)
+
+    ctx = multiprocessing.get_context("spawn")
+    ports = ctx.Queue()
+    servers = [ctx.Process(target=serve, args=(handler, root, ports), daemon=True)
+               for handler, root in [(AppHandler, app_root), (S3Handler, s3_root)]]
+    for server in servers:
+        server.start()
+    server_ports = dict(ports.get() for _ in servers)
+    app_url = f"http://127.0.0.1:{server_ports['AppHandler']}"
+
+    with open(os.path.join(app_root, "job.json"), "w") as f:
+        json.dump(job_definition(app_url, args), f)
+
+    environ = {
+        "PATH": f"{STUBS_DIR}{os.pathsep}{os.environ['PATH']}",
+        "INIT_JOB_URL": f"{app_url}/init",
+        "INIT_TOKEN": "bench",
+        "TIMEOUT_SECONDS": str(args.timeout),
+        "S3_ENDPOINT_URL": f"http://127.0.0.1:{server_ports['S3Handler']}",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        # the stand-in doesn't implement S3's checksum trailers
+        "AWS_REQUEST_CHECKSUM_CALCULATION": "when_required",
+        "AWS_RESPONSE_CHECKSUM_VALIDATION": "when_required",
+        "EARTHMOVER_IN_PROCESS": "false",
+        # every scale has its own roster, so one job's must never be reused by the next
+        "ROSTER_CACHE_TTL_SECONDS": "0",
+        **({"CROSS_YEAR_SINGLE_PASS": "true"} if args.single_pass else {}),
+        **({"TRANSCODE_INPUT": "true"} if args.transcode_input else {}),
+        # shard any input of at least a megabyte, so that sharding is exercised at benchmark scales
+        **({"EARTHMOVER_SHARDS": str(args.shards), "EARTHMOVER_SHARD_MIN_BYTES": str(1024 * 1024)} if args.shards > 1 else {}),
+        **({"BENCH_VERBOSE": "1"} if args.verbose else {}),
+    }
+
+    results = []
+    try:
+        for rows in args.rows:
+            paths = generate_data(data_dir, rows, args)
+            result = measure(workdir, environ, rows, paths, app_root, s3_root)
+            report(result)
+            results.append(result)
+    finally:
+        for server in servers:
+            server.terminate()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    exit_code = 0 if all(r["succeeded"] for r in results) else 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f))
+        for r in found:
+            print(f"REGRESSION {r}")
+        if found:
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark a whole executor job against local stand-ins")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="input rows per job, one job per value (10k to 10M is typical)")
+    parser.add_argument("--encoding", default="utf-8", help="encoding of the synthetic input file")
+    parser.add_argument("--ods-match", type=float, default=0.9, help="fraction of students in the ODS roster")
+    parser.add_argument("--edu-match", type=float, default=0.99, help="fraction of students in the EDU (cross-year) roster")
+    parser.add_argument("--no-cross-year", action="store_true", help="run without EDU access, so only one Earthmover pass")
+    parser.add_argument("--single-pass", action="store_true", help="match against both rosters in one Earthmover pass")
+    parser.add_argument("--transcode-input", action="store_true", help="transcode a non-UTF-8 input to UTF-8 before Earthmover runs")
+    parser.add_argument("--shards", type=int, default=1, help="run Earthmover on up to this many shards of the input at once")
+    parser.add_argument("--timeout", type=int, default=3600, help="job timeout in seconds")
+    parser.add_argument("--workdir", help="keep the job's working directory and generated data here for reuse")
+    parser.add_argument("--output", help="write the measurements to this JSON file")
+    parser.add_argument("--baseline", help="compare against measurements previously written with --output")
+    parser.add_argument("--verbose", action="store_true", help="show the executor's own logging")
+    sys.exit(main(parser.parse_args()))
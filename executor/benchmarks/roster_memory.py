@@ -0,0 +1,68 @@
+# Benchmark: memory used by roster ID analysis as roster size grows.
+#
+# Generates synthetic stu-ed-org rosters of increasing size and runs the same streaming scan that
+# unpack_id_types() uses over each, recording wall time and peak Python heap allocation. Peak memory
+# should stay flat regardless of roster size; the script exits non-zero if it does not.
+#
+#   python benchmarks/roster_memory.py [num_records ...]
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from executor.roster import scan_roster_file
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+# allowed growth in peak memory between the smallest and largest roster
+MAX_PEAK_GROWTH = 2.0
+
+
+def write_roster(path, num_records):
+    """Write a roster where State IDs replicate studentUniqueId and Local IDs are mostly populated"""
+    with open(path, "w") as f:
+        for i in range(num_records):
+            codes = [{
+                "studentIdentificationSystemDescriptor": "uri://ed-fi.org/StudentIdentificationSystemDescriptor#State",
+                "identificationCode": str(100000000 + i),
+            }]
+            if i % 4:
+                codes.append({
+                    "studentIdentificationSystemDescriptor": "uri://ed-fi.org/StudentIdentificationSystemDescriptor#Local",
+                    "identificationCode": f"L{i}",
+                })
+            f.write(json.dumps({
+                "educationOrganizationReference": {"educationOrganizationId": 255901},
+                "studentReference": {"studentUniqueId": str(100000000 + i)},
+                "studentIdentificationCodes": codes,
+            }) + "\n")
+
+
+def main(sizes):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = os.path.join(tmp, f"roster-{n}.jsonl")
+            write_roster(path, n)
+
+            tracemalloc.start()
+            start = time.monotonic()
+            stats = scan_roster_file(path)
+            seconds = time.monotonic() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            replica, _ = stats.stu_unique_id_replica()
+            results.append((n, os.stat(path).st_size, seconds, peak))
+            print(f"{n:>10} records  {os.stat(path).st_size / 2**20:>8.1f} MiB  {seconds:>7.2f} s  peak {peak / 2**10:>8.1f} KiB  "
+                  f"types={sorted(stats.distinct_id_types())} replica={replica}")
+
+    growth = results[-1][3] / results[0][3]
+    print(f"peak memory growth from {results[0][0]} to {results[-1][0]} records: {growth:.2f}x")
+    return 0 if growth <= MAX_PEAK_GROWTH else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES))
@@ -12,6 +12,11 @@ class JobArtifact:
         self.name = name
         self.path = path
         self.needs_upload = needs_upload
+        # jobs flip needs_upload as they go; reset() restores this for the next job
+        self.default_needs_upload = needs_upload
+
+    def reset(self):
+        self.needs_upload = self.default_needs_upload
 
 
 ROSTER = JobArtifact(
@@ -51,4 +56,16 @@ LB_SEND_RESULTS = JobArtifact(
     "lb-send-results.json"
 )
 
-ALL = [ROSTER, CROSS_YEAR_ROSTER, EM_RESULTS, EM_RESULTS_X_YEAR, MATCH_RATES, UNMATCHED_STUDENTS, LB_SEND_RESULTS]
\ No newline at end of file
+# Per-action wall time, CPU, memory, and bytes transferred; written as the job shuts down
+TIMINGS = JobArtifact(
+    "timings",
+    "timings.json"
+)
+
+ALL = [ROSTER, CROSS_YEAR_ROSTER, EM_RESULTS, EM_RESULTS_X_YEAR, MATCH_RATES, UNMATCHED_STUDENTS, LB_SEND_RESULTS, TIMINGS]
+
+
+def reset_all():
+    """Restore every artifact's upload flag before a new job starts"""
+    for a in ALL:
+        a.reset()
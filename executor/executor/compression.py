@@ -0,0 +1,64 @@
+# Compressed uploads shrink large artifacts, like rosters, on their way to S3.
+#
+# A CompressingReader is a readable stream over a local file that compresses the file's contents as they
+# are read, so an artifact can be handed straight to boto3's upload_fileobj without a compressed copy
+# ever being written to disk. The object is stored with a matching Content-Encoding, so HTTP clients
+# (including browsers following presigned links) decompress it transparently.
+
+import io
+import zlib
+
+try:
+    # optional: zstd compresses JSONL better and faster than gzip
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_BYTES = 1024 * 1024
+GZIP_LEVEL = 6
+
+
+def available_encodings():
+    """Content-Encodings that this environment can produce"""
+    return ["gzip", "zstd"] if zstandard else ["gzip"]
+
+
+class CompressingReader(io.RawIOBase):
+    def __init__(self, path, encoding):
+        if encoding == "gzip":
+            # wbits=31 writes a gzip header and trailer rather than a bare zlib stream
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        elif encoding == "zstd" and zstandard:
+            self._compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            raise ValueError(f"unsupported content encoding: {encoding}")
+        self.encoding = encoding
+        self._source = open(path, "rb")
+        self._buffer = bytearray()
+        self._finished = False
+        # uncompressed bytes read from the file, and compressed bytes handed out
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b) and not self._finished:
+            chunk = self._source.read(READ_BYTES)
+            if chunk:
+                self.bytes_in += len(chunk)
+                self._buffer += self._compressor.compress(chunk)
+            else:
+                self._buffer += self._compressor.flush()
+                self._finished = True
+
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        del self._buffer[:n]
+        self.bytes_out += n
+        return n
+
+    def close(self):
+        self._source.close()
+        super().close()
@@ -4,11 +4,126 @@ OUTPUT_DIR = 'output'
 OUTPUT_DIR_FIRST_RUN = 'output-first-run'
 ROSTER_DOWNLOAD_DIR = 'roster-download-dir'
 CROSS_YEAR_ROSTER_PATH = 'cross_year_roster.jsonl'
+# when performing single-pass cross-year matching: the current-year and cross-year rosters combined
+UNION_ROSTER_PATH = 'union_roster.jsonl'
+# the Earthmover destination with one record per matched input row; single-pass cross-year matching counts
+# its records of ODS students to tell how many input rows the ODS roster alone would have matched
+STUDENT_ASSESSMENTS_DESTINATION = 'studentAssessments'
+# results that are reusable across Earthmover passes (and across jobs, when one container runs several)
+CACHE_DIR = '.executor-cache'
+
+# shallow bundle refreshes only check out these paths of the bundles repo, plus the job's bundle
+BUNDLE_SPARSE_PATHS = ['packages']
+# how long a branch-to-commit lookup against the bundles remote is trusted
+BUNDLE_REF_CACHE_SECONDS = 60
+# number of installed earthmover package trees kept for reuse by later jobs
+DEPS_CACHE_MAX_ENTRIES = 8
+# number of successful `earthmover compile` markers kept, most recently used first
+COMPILE_CACHE_MAX_ENTRIES = 32
+# how long a roster fetched from an ODS is reused by later jobs against the same ODS, client, and year
+# (override with the ROSTER_CACHE_TTL_SECONDS environment variable; 0 disables), and how many are kept.
+# Kept short, since users who find students missing from their ODS fix it and rerun; a roster that left
+# input rows unmatched is also dropped from the cache right away
+ROSTER_CACHE_TTL_SECONDS = 300
+ROSTER_CACHE_MAX_ENTRIES = 4
 
 REQUIRED_ID_MATCH_RATE = 0.5
 STUDENT_ASSESSMENT_FAIL_THRESHOLD = 0.75
 
+# before Earthmover's first pass, a sample of this many input rows, taken from MATCH_PROBE_SLICES evenly
+# spaced places in the file, is matched against the roster (see match_probe.py). The probe compares exact
+# strings rather than using the wrapper's ID matching, so when no cross-year pass can follow, the job only
+# fails right away if the estimated match rate is below MATCH_PROBE_FAIL_FRACTION of REQUIRED_ID_MATCH_RATE.
+# Only delimited text inputs are probed, and tiny samples are not trusted
+MATCH_PROBE_SAMPLE_ROWS = 5000
+MATCH_PROBE_SLICES = 10
+MATCH_PROBE_MIN_ROWS = 100
+MATCH_PROBE_FAIL_FRACTION = 0.2
+MATCH_PROBE_EXTENSIONS = [".csv", ".tsv", ".txt"]
+
+# Earthmover can split a delimited input into shards that it runs on concurrently (see shards.py), up to
+# EARTHMOVER_SHARDS of them (override with the EARTHMOVER_SHARDS environment variable; 1 never shards).
+# Every shard gets at least EARTHMOVER_SHARD_MIN_BYTES of the input (also overridable), so small inputs
+# run whole. Every shard's Earthmover loads the whole roster, so memory use grows with the number of
+# shards: each is assumed to need EARTHMOVER_SHARD_MEMORY_FACTOR times the size of the roster file plus
+# its share of the input, and no more shards run than fit in the memory available
+EARTHMOVER_SHARDS = 1
+EARTHMOVER_SHARD_MIN_BYTES = 64 * 1024 * 1024
+EARTHMOVER_SHARD_MEMORY_FACTOR = 10
+EARTHMOVER_SHARD_EXTENSIONS = [".csv", ".tsv", ".txt"]
+EARTHMOVER_SHARD_DIR = 'earthmover-shards'
+
 # set of alternate encodings we think are realistic for assessment files
 # python has no UTF-16-SIG encoding, and chardet does not distinguish between UTF-16 BE and LE
 PLAUSIBLE_NON_UTF8_ENCODINGS = ["UTF-8-SIG", "UTF-16", "ISO-8859-1", "Windows-1252"]
-MAX_ENCODING_DETECTION_SECONDS = 300
\ No newline at end of file
+MAX_ENCODING_DETECTION_SECONDS = 300
+# encoding detection examines at most this many bytes, sampled from the head, middle, and tail of the
+# input file. Set to None to examine the entire file
+ENCODING_DETECTION_SAMPLE_BYTES = 3 * 1024 * 1024
+# the pre-flight decode check reads the input file in chunks of this size
+ENCODING_PREFLIGHT_CHUNK_BYTES = 16 * 1024 * 1024
+# input files with these extensions that need a non-UTF-8 encoding are transcoded to UTF-8 once they're
+# downloaded, when enabled with TRANSCODE_INPUT=true
+TRANSCODE_INPUT_EXTENSIONS = [".csv", ".tsv", ".txt"]
+
+# environment variables templated into the student ID wrapper's config. Together with the bundle commit,
+# project YAML, and the job's input params, they determine whether a previous `earthmover compile` still holds
+EARTHMOVER_COMPILE_ENV_VARS = [
+    "ASSESSMENT_BUNDLE",
+    "ASSESSMENT_BUNDLE_BRANCH",
+    "EDFI_ROSTER_SOURCE_TYPE",
+    "EDFI_STUDENT_ID_TYPES",
+    "POSSIBLE_STUDENT_ID_COLUMNS",
+    "REQUIRED_ID_MATCH_RATE",
+]
+
+# S3 transfers: the executor moves several files at once (input bundles, output sets), so we run
+# multiple transfers in parallel and let boto3 split large files into multipart chunks
+S3_TRANSFER_MAX_WORKERS = 8
+S3_MULTIPART_THRESHOLD_BYTES = 16 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE_BYTES = 16 * 1024 * 1024
+S3_MULTIPART_MAX_CONCURRENCY = 4
+
+# output of earthmover and lightbeam is logged as it's produced; only this many of the last lines of each
+# stream are kept for error reporting, each cut to at most this many characters
+PROCESS_OUTPUT_TAIL_LINES = 200
+PROCESS_OUTPUT_MAX_LINE_CHARS = 4096
+
+# callbacks to the app are delivered in the background (see reporter.py). Each is attempted up to
+# REPORTER_MAX_ATTEMPTS times with jittered exponential backoff, and at shutdown the executor waits at
+# most REPORTER_FLUSH_SECONDS for any still queued. None waits until every one has been delivered or given
+# up on: the app only completes a run once it receives the final DONE update, so that is never abandoned
+# while the reporter is still retrying it
+REPORTER_MAX_ATTEMPTS = 5
+REPORTER_BACKOFF_BASE_SECONDS = 1
+REPORTER_BACKOFF_MAX_SECONDS = 15
+REPORTER_REQUEST_TIMEOUT_SECONDS = 30
+REPORTER_FLUSH_SECONDS = None
+
+# streamed downloads from the app (the cross-year roster) resume after an interruption when the app
+# supports it. A download fails after DOWNLOAD_MAX_ATTEMPTS attempts that didn't move it forward, with
+# jittered exponential backoff between them, and a body that goes quiet for DOWNLOAD_READ_TIMEOUT_SECONDS
+# counts as interrupted. The wait for the response to begin is separate: the app runs the roster query
+# before it sends anything, which can take minutes, so by default (None) there is no limit on it
+DOWNLOAD_MAX_ATTEMPTS = 5
+DOWNLOAD_BACKOFF_BASE_SECONDS = 1
+DOWNLOAD_BACKOFF_MAX_SECONDS = 30
+DOWNLOAD_CONNECT_TIMEOUT_SECONDS = 30
+DOWNLOAD_READ_TIMEOUT_SECONDS = 300
+DOWNLOAD_RESPONSE_TIMEOUT_SECONDS = None
+
+# artifacts that are compressed on upload when ARTIFACT_COMPRESSION (gzip or zstd) is set. Only the
+# rosters by default: the app reads the unmatched students and match rates files itself
+COMPRESSED_ARTIFACTS = ["edfi_roster", "cross_year_roster"]
+
+# when a job ends without using its speculatively prefetched cross-year roster, how long to wait for the
+# prefetch to notice it has been cancelled
+PREFETCH_CANCEL_WAIT_SECONDS = 10
+# when a job is interrupted while concurrent stages are in flight, how long to wait for them to stop once
+# their downloads are cancelled and their subprocesses killed
+STAGE_STOP_WAIT_SECONDS = 30
+
+# worker mode (see JobExecutor.work): how often to check the local job queue, and how long
+# the worker waits for a new job before shutting down
+WORKER_POLL_SECONDS = 5
+WORKER_MAX_IDLE_SECONDS = 300
@@ -0,0 +1,92 @@
+# In-process Earthmover runs the executor's `earthmover` commands through Earthmover's Python API
+# rather than by launching the CLI.
+#
+# Each CLI invocation re-imports pandas, dask, and numpy, which costs seconds per command. Running in
+# process pays that once per executor process. The project config is still parsed fresh on every
+# command, since it is templated from environment variables that change between passes.
+#
+# Results mimic process_output.run_logged(): Earthmover's log output and anything printed are logged
+# line by line as stderr/stdout, only their tails are kept, and failures produce a non-zero returncode,
+# so callers can treat both modes identically.
+
+import argparse
+import contextlib
+import datetime
+import logging
+import os
+import subprocess
+import traceback
+
+from executor.process_output import OutputTail
+
+
+class _ExitOnErrorHandler(logging.StreamHandler):
+    """Earthmover relies on its CLI's log handler to abort the run on an error-level message"""
+    def emit(self, record):
+        super().emit(record)
+        if record.levelno in (logging.ERROR, logging.CRITICAL):
+            raise SystemExit(1)
+
+
+_parser = argparse.ArgumentParser(prog="earthmover", add_help=False)
+_parser.add_argument("command")
+_parser.add_argument("-c", "--config-file")
+_parser.add_argument("-r", "--results-file", default="")
+_parser.add_argument("--set", nargs="*")
+
+
+def run_earthmover(args, logger):
+    """Run an `earthmover ...` command line (args[0] is "earthmover") in this process, logging its output to logger
+
+    Returns a subprocess.CompletedProcess with the tails of stdout and stderr
+    """
+    # imported here so that the executor only pays for the scientific stack when this mode is used
+    from earthmover.earthmover import Earthmover
+
+    parsed = _parser.parse_args(args[1:])
+    overrides = dict(zip(parsed.set[::2], parsed.set[1::2])) if parsed.set else None
+
+    stdout = OutputTail(lambda line: logger.info(f"earthmover stdout: {line}"))
+    stderr = OutputTail(lambda line: logger.info(f"earthmover stderr: {line}"))
+    handler = _ExitOnErrorHandler(stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s.%(msecs)03d %(name)s %(levelname)s %(message)s", "%Y-%m-%d %H:%M:%S"))
+    em_logger = logging.getLogger("earthmover")
+    em_logger.addHandler(handler)
+    em_logger.propagate = False
+
+    # Earthmover changes directory to the project; the executor works with paths relative to its own
+    cwd = os.getcwd()
+    returncode = 0
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            # the CLI stamps this once at import; refresh it so results-file runtimes are per-command
+            Earthmover.start_timestamp = datetime.datetime.now()
+            em = Earthmover(
+                config_file=parsed.config_file,
+                logger=em_logger,
+                results_file=parsed.results_file,
+                overrides=overrides,
+            )
+            if parsed.command == "deps":
+                em.deps()
+            elif parsed.command == "compile":
+                em.compile(to_disk=True)
+            elif parsed.command == "run":
+                em.generate(selector="*")
+            else:
+                raise ValueError(f"unsupported earthmover command: {parsed.command}")
+    except SystemExit as e:
+        returncode = 0 if e.code is None else e.code if isinstance(e.code, int) else 1
+    except TimeoutError:
+        # the executor's job timeout; that is not an Earthmover failure
+        raise
+    except Exception:
+        stderr.write(traceback.format_exc())
+        returncode = 1
+    finally:
+        os.chdir(cwd)
+        em_logger.removeHandler(handler)
+        stdout.close()
+        stderr.close()
+
+    return subprocess.CompletedProcess(args, returncode, stdout.getvalue(), stderr.getvalue())
@@ -1,19 +1,26 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import csv
+import hashlib
 import json
 import logging
 from pprint import pprint
 import os
+import random
+import re
 import shutil
 import signal
 import subprocess
+import threading
 import time
 import traceback
 from urllib import parse
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 import botocore
+import botocore.config
 import botocore.exceptions
-from chardet.universaldetector import UniversalDetector
 import requests
 
 import executor.actions as action
@@ -21,7 +28,19 @@ import executor.action_statuses as status
 import executor.artifacts as artifact
 import executor.config as config
 import executor.errors as error
+from executor.compression import CompressingReader, available_encodings
+from executor.earthmover_in_process import run_earthmover
+from executor.input_encoding import detect_encoding, first_decodable, transcode_to_utf8
+from executor.match_probe import estimate_match_rate
 from executor.output_sets import OutputSet
+from executor.process_output import run_logged
+from executor.reporter import Reporter
+from executor.roster import RosterIdStats, scan_roster_file, write_stream
+from executor.roster_cache import RosterCache, file_sha256, link_or_copy
+from executor.shards import available_memory, input_header_rows, merge_shards, split_input, winning_match
+from executor.single_pass import sideload_ods_students, split_output, union_rosters, write_split_results
+from executor.stages import Stage, StageFailure, run_stages
+from executor.timings import ActionTimings
 
 handler = logging.StreamHandler()
 _formatter = logging.Formatter(
@@ -40,13 +59,8 @@ class JobExecutor:
         self.logger = logging.getLogger("runway")
         self.logger.setLevel(logging.getLevelName("DEBUG"))
         self.logger.propagate = False
-        self.logger.addHandler(handler)
-
-        self.action = ""
-        self.error = None
-        self.summary = {}
-        self.timeout_seconds = int(os.environ.get("TIMEOUT_SECONDS"))
-
+        if handler not in self.logger.handlers:
+            self.logger.addHandler(handler)
 
         self.wrapper_project = os.path.join(
             config.BUNDLE_DIR, "packages", "student_id_wrapper"
@@ -55,15 +69,130 @@ class JobExecutor:
             self.wrapper_project, "earthmover.yaml"
         )
 
-        endpoint_url = os.environ.get("S3_ENDPOINT_URL")
-        self.s3 = boto3.client("s3", **({"endpoint_url": endpoint_url} if endpoint_url else {}))
+        self.s3_transfer_config = TransferConfig(
+            multipart_threshold=config.S3_MULTIPART_THRESHOLD_BYTES,
+            multipart_chunksize=config.S3_MULTIPART_CHUNKSIZE_BYTES,
+            max_concurrency=config.S3_MULTIPART_MAX_CONCURRENCY,
+        )
         self.local_mode = os.environ.get("DEPLOYMENT_MODE") == "LOCAL"
-        self.conn = requests.Session()
+        # drive Earthmover through its Python API instead of launching the CLI for every command
+        self.earthmover_in_process = os.environ.get("EARTHMOVER_IN_PROCESS", "").lower() == "true"
+        # "full" (default) or "shallow"; see refresh_bundle_code()
+        self.bundle_refresh_mode = os.environ.get("BUNDLE_REFRESH_MODE", "full").lower()
+        # match against the current-year and cross-year rosters in one Earthmover pass; see single_pass_cross_year()
+        self.cross_year_single_pass = os.environ.get("CROSS_YEAR_SINGLE_PASS", "").lower() == "true"
+        # run Earthmover on up to this many shards of a large input at once; see earthmover_run_sharded()
+        self.earthmover_shards = int(os.environ.get("EARTHMOVER_SHARDS", config.EARTHMOVER_SHARDS))
+        self.earthmover_shard_min_bytes = int(os.environ.get("EARTHMOVER_SHARD_MIN_BYTES", config.EARTHMOVER_SHARD_MIN_BYTES))
+        # transcode non-UTF-8 input files once, up front; see transcode_input()
+        self.transcode_input_enabled = os.environ.get("TRANSCODE_INPUT", "").lower() == "true"
+        # Content-Encoding for large artifacts on upload ("gzip" or "zstd"); unset uploads them as they are
+        self.artifact_compression = os.environ.get("ARTIFACT_COMPRESSION", "").lower() or None
+        if self.artifact_compression and self.artifact_compression not in available_encodings():
+            self.logger.warning(f"artifact compression {self.artifact_compression} is unavailable; using gzip")
+            self.artifact_compression = "gzip"
+        # ODS rosters reused across jobs; see get_roster_from_ods()
+        self.roster_cache = RosterCache(
+            os.path.join(config.CACHE_DIR, "rosters"),
+            int(os.environ.get("ROSTER_CACHE_TTL_SECONDS", config.ROSTER_CACHE_TTL_SECONDS)),
+        )
+
+        # jobs mutate the environment heavily (see unpack_job and cross_year_pass); each job starts from this
+        self.base_environ = dict(os.environ)
+        # files outside the per-job directories that the current job downloaded
+        self.job_files = []
+        # cleared when a job leaves work running that could interfere with the next job; see work()
+        self.reusable = True
+        # each concurrent stage's thread records its own error here; see the error property
+        self.stage_local = threading.local()
+        self.reset_job_state()
+
+    @property
+    def error(self):
+        """The ExecutorError to report for the job, or, in a stage's thread, the one that stage recorded
+
+        Stages run concurrently and each records its error by assigning self.error before raising, so they
+        get separate slots; otherwise one stage's failure could be reported with another's error.
+        """
+        slot = getattr(self.stage_local, "slot", None)
+        return self._error if slot is None else slot["error"]
+
+    @error.setter
+    def error(self, value):
+        slot = getattr(self.stage_local, "slot", None)
+        if slot is None:
+            self._error = value
+        else:
+            slot["error"] = value
+
+    def reset_job_state(self, job_environ=None):
+        """Return the executor to a clean slate so it can run a job
+
+        Called once on construction, and again before every job when one process runs several. job_environ
+        is layered over the environment the process started with, e.g. to supply a job's INIT_TOKEN.
+        """
+        os.environ.clear()
+        os.environ.update(self.base_environ)
+        os.environ.update(job_environ or {})
+        artifact.reset_all()
+
+        self.action = ""
+        # actions currently being performed by concurrent stages
+        self.running_actions = []
+        # background download of the cross-year roster; see start_cross_year_prefetch()
+        self.prefetch_thread = None
+        # subprocesses the job is running, and the signal to cancel downloads, so that stages can be stopped;
+        # see stop_stages()
+        self.running_procs = set()
+        self.stage_cancel = threading.Event()
+        self.error = None
+        self.summary = {}
+        self.timings = ActionTimings()
+        # encoding guesses and pre-flight results per input file, so repeated Earthmover passes don't redo them
+        self.encoding_cache = {}
+        # how often Earthmover still failed to decode the input after the pre-flight check
+        self.encoding_fallbacks = 0
+        # the roster cache entry the job's ODS roster came from or went into; see invalidate_roster_cache()
+        self.roster_cache_key = None
+        self.timeout_seconds = int(os.environ.get("TIMEOUT_SECONDS"))
+
+        # set from the job definition by unpack_job() and by later actions. Until then there is nowhere to
+        # report or upload to, and nothing is left over from the previous job for a failure to report
+        self.status_url = None
+        self.error_url = None
+        self.matches_url = None
+        self.summary_url = None
+        self.output_files_url = None
+        self.send_to_ods = None
+        self.cross_year_match_available = False
+        self.app_bucket = None
+        self.s3_in_path = None
+        self.s3_out_path = None
+        self.input_sources = {}
+        self.output_sets = []
+        self.num_unmatched_students = None
+        self.highest_match_rate = 0.0
+        self.highest_match_id_name = "N/A"
+        self.highest_match_id_type = "N/A"
+        self.roster_stats = RosterIdStats()
+        self.bundle_commit = None
 
-        # wipe state left behind by a prior local run so reruns are idempotent
+        # a fresh session, so one job's bearer token never leaks into the next
+        self.conn = make_app_session()
+        # and a fresh S3 client, since each job brings its own short-lived credentials (AWS_ACCESS_KEY_ID,
+        # AWS_SECRET_ACCESS_KEY, AWS_SESSION_TOKEN) scoped to its own run
+        self.s3 = make_s3_client()
+
+        # wipe state left behind by a prior run so reruns are idempotent
         shutil.rmtree(".lightbeam", ignore_errors=True)
+        shutil.rmtree(config.OUTPUT_DIR, ignore_errors=True)
         shutil.rmtree(config.OUTPUT_DIR_FIRST_RUN, ignore_errors=True)
         shutil.rmtree(config.ROSTER_DOWNLOAD_DIR, ignore_errors=True)
+        shutil.rmtree(config.EARTHMOVER_SHARD_DIR, ignore_errors=True)
+        for path in self.job_files + [a.path for a in artifact.ALL]:
+            if os.path.isfile(path):
+                os.remove(path)
+        self.job_files = []
 
         self.output_dir = os.path.abspath(config.OUTPUT_DIR)
         os.mkdir(self.output_dir)
@@ -75,10 +204,41 @@ class JobExecutor:
         os.environ["EDFI_ROSTER_FILE"] = artifact.ROSTER.path
         os.environ["TEMPORARY_DIRECTORY"] = "/tmp"
 
-        # add retry logic
-        retries = requests.adapters.Retry()
-        self.conn.mount("http://", requests.adapters.HTTPAdapter(max_retries=retries))
-        self.conn.mount("https://", requests.adapters.HTTPAdapter(max_retries=retries))
+        # callbacks to the app go through this so the job never waits on them. Its thread gets a session of its
+        # own, since requests sessions aren't guaranteed to be thread-safe; execute() gives it the bearer token
+        self.reporter = Reporter(make_app_session(), self.logger)
+
+    def work(self, queue_dir):
+        """Run jobs one after another from a local queue directory until it has been idle for a while
+
+        Each *.json file in queue_dir describes one job as environment variables for the usual handshake
+        (INIT_JOB_URL, INIT_TOKEN, TIMEOUT_SECONDS). A worker claims a file by renaming it, so several
+        workers can share one queue.
+        """
+        idle_since = time.monotonic()
+        while time.monotonic() - idle_since < config.WORKER_MAX_IDLE_SECONDS:
+            claimed = claim_queued_job(queue_dir)
+            if claimed is None:
+                time.sleep(config.WORKER_POLL_SECONDS)
+                continue
+
+            try:
+                with open(claimed) as f:
+                    job_environ = {k: str(v) for k, v in json.load(f).items()}
+                self.logger.info(f"worker: starting job from {claimed}")
+                self.reset_job_state(job_environ)
+                self.execute()
+            except Exception:
+                # execute() reports its own failures; this only guards the worker against the unexpected
+                self.logger.error(f"worker: job from {claimed} raised", exc_info=True)
+            finally:
+                os.remove(claimed)
+            if not self.reusable:
+                # e.g. a timed-out job's stage is still writing to the working directory or the environment
+                self.logger.warning("worker: the last job left work running; exiting so the next job starts in a fresh process")
+                return
+            idle_since = time.monotonic()
+        self.logger.info(f"worker: queue idle for {config.WORKER_MAX_IDLE_SECONDS} seconds; exiting")
 
     def timeout_handler(self, signum, frame):
         self.error = error.ExecutorTimeout(self.timeout_seconds)
@@ -103,19 +263,13 @@ class JobExecutor:
             init_info = init_resp.json()
 
             self.conn.headers.update({"Authorization": f"Bearer {init_info['token']}"})
+            self.reporter.session.headers.update(self.conn.headers)
             job = self.conn.get(init_info["jobUrl"]).json()
 
             self.unpack_job(job)
-            self.refresh_bundle_code()
-            self.earthmover_deps()
-
-            if self.send_to_ods and self.local_mode:
-                self.modify_local_lightbeam()
-
-            self.get_student_roster()
-            self.get_input_files()
-
-            self.map_descriptors()
+            if self.send_to_ods and self.cross_year_match_available:
+                self.start_cross_year_prefetch()
+            self.acquire_inputs()
             self.orchestrate_earthmover()
 
             self.lightbeam_send()
@@ -157,7 +311,17 @@ class JobExecutor:
             # in the future we may wish to perform additional cleanup here,
             # e.g. deleting data from the container as a security measure
             self.logger.info("spinning down")
+            signal.alarm(0)
+            self.discard_cross_year_prefetch()
+            try:
+                self.write_timings()
+                self.upload_artifact(artifact.TIMINGS, fail_ok=True)
+            except Exception as e:
+                self.logger.error(f"could not record timings ({repr(e)}); continuing", exc_info=True)
             self.send_update(action.DONE, status.SUCCESS if success else status.FAILURE)
+            if not self.reporter.flush(config.REPORTER_FLUSH_SECONDS):
+                self.logger.warning(f"app callbacks still undelivered after {config.REPORTER_FLUSH_SECONDS} seconds; abandoning them")
+            self.reporter.close()
 
     def unpack_job(self, job):
         """Parse the job definition received from the app"""
@@ -203,6 +367,7 @@ class JobExecutor:
                 # remove the secret so we don't log it
                 del job["assessmentDatastore"]["clientSecret"]
 
+            self.bundle_path = job["bundle"]["path"]
             os.environ["ASSESSMENT_BUNDLE"] = os.path.basename(job["bundle"]["path"])
             os.environ["ASSESSMENT_BUNDLE_BRANCH"] = job["bundle"]["branch"]
 
@@ -217,6 +382,7 @@ class JobExecutor:
             self.descriptor_map = job["customDescriptorMappings"]
 
             # note that API_YEAR is guaranteed to be included in this
+            self.input_param_names = sorted(job["inputParams"].keys())
             for env_name, value in job["inputParams"].items():
                 os.environ[env_name] = str(value)
         except KeyError as e:
@@ -230,55 +396,237 @@ class JobExecutor:
             raise ValueError(err_message)
         pprint(job)
 
-    def refresh_bundle_code(self):
-        """Pull from the bundles repo to ensure the latest code is being used"""
-        self.set_action(action.BUNDLE_REFRESH)
+    def acquire_inputs(self):
+        """Prepare the bundle, fetch the roster, and download input files, overlapping whatever is independent
 
+        Each stage reports its own begin/success updates. If any stage fails, the job fails as though that
+        stage had been the current action.
+        """
+        stages = [
+            Stage(action.BUNDLE_REFRESH, self.refresh_bundle_code),
+            Stage(action.EARTHMOVER_DEPS, self.prepare_bundle, after=[action.BUNDLE_REFRESH]),
+            # lightbeam reads the assessment bundle's lightbeam.yaml, which only exists once deps are installed.
+            # Rosters from EDU or S3 don't touch the bundle at all
+            Stage(action.GET_ROSTER, self.get_student_roster, after=[action.EARTHMOVER_DEPS] if self.send_to_ods else []),
+            Stage(action.GET_FILES, self.get_input_files),
+        ]
+        for stage in stages:
+            stage.run = self.with_own_error(self.attributed(stage.action, stage.run))
         try:
-            # the branch we're about to try to check out may not exist
-            subprocess.run(
-                ["git", "-C", config.BUNDLE_DIR, "fetch"]
-            ).check_returncode()
+            run_stages(stages, self.begin_stage, self.succeed_stage, lambda: self.error)
+        except StageFailure as failure:
+            self.action = failure.stage.action
+            self.error = failure.executor_error
+            raise failure.exception from None
+        except BaseException:
+            # e.g. the job timed out while stages were in flight; attribute it to one that was still running
+            if self.running_actions:
+                self.action = self.running_actions[0]
+            self.stop_stages(stages)
+            raise
 
-            #    ASSESSMENT_BUNDLE_BRANCH is intended to be passed to Earthmover but we
-            # can utilize it to enable non-main code to be run if the app dictates it
-            subprocess.run(
-                ["git", "-C", config.BUNDLE_DIR, "checkout", os.environ["ASSESSMENT_BUNDLE_BRANCH"]]
-            ).check_returncode()
+    def stop_stages(self, stages):
+        """Stop stages left in flight by an interrupted job, so that none of them outlives it
 
-            subprocess.run(
-                ["git", "-C", config.BUNDLE_DIR, "pull", "--ff-only"]
-            ).check_returncode()
+        Cancellable downloads are cancelled and the stages' subprocesses are killed. If a stage still hasn't
+        returned after STAGE_STOP_WAIT_SECONDS, this process is no longer fit to run another job.
+        """
+        self.stage_cancel.set()
+        for proc in list(self.running_procs):
+            proc.kill()
+        deadline = time.monotonic() + config.STAGE_STOP_WAIT_SECONDS
+        for stage in stages:
+            if stage.thread:
+                stage.thread.join(max(0, deadline - time.monotonic()))
+        stuck = [stage.action for stage in stages if stage.thread and stage.thread.is_alive()]
+        if stuck:
+            self.logger.warning(f"stages still running after {config.STAGE_STOP_WAIT_SECONDS} seconds: {stuck}")
+            self.reusable = False
+
+    def begin_stage(self, stage_action):
+        """Report the beginning of an action that runs alongside others"""
+        self.running_actions.append(stage_action)
+        self.logger.info(f"beginning action: {stage_action}")
+        self.timings.begin(stage_action)
+        self.send_update(stage_action, status.BEGIN)
+
+    def succeed_stage(self, stage_action):
+        """Report the success of an action that runs alongside others"""
+        self.running_actions.remove(stage_action)
+        self.send_update(stage_action, status.SUCCESS, self.timings.end(stage_action, status.SUCCESS))
+
+    def attributed(self, stage_action, run):
+        """Wrap a stage's function so that data it transfers is counted against its action"""
+        def attributed_run():
+            self.timings.attribute_to(stage_action)
+            run()
+        return attributed_run
+
+    def with_own_error(self, run):
+        """Wrap a stage's function so that the error it records is kept apart from other stages'"""
+        def run_with_own_error():
+            self.stage_local.slot = {"error": None}
+            run()
+        return run_with_own_error
+
+    def refresh_bundle_code(self):
+        """Pull from the bundles repo to ensure the latest code is being used"""
+        try:
+            if self.bundle_refresh_mode == "shallow":
+                self.refresh_bundle_code_shallow()
+            else:
+                self.refresh_bundle_code_full()
+
+            self.bundle_commit = git_head(config.BUNDLE_DIR)
+            self.logger.info(f"bundle code at commit {self.bundle_commit}")
         except subprocess.CalledProcessError:
             self.error = error.GitPullError()
             raise
-    
-    def earthmover_cmd(self, **kwargs):
-        """Thinly wrap our em calls to handle invocation and logging. Returns either a CompletedProcess object or CalledProcessError object"""
 
-        em=subprocess.run(
-            **kwargs
+    # git commands that go over the network run through run_logged() so that stop_stages() can kill them
+
+    def refresh_bundle_code_full(self):
+        """Fetch every branch and fast-forward the job's branch"""
+        # the branch we're about to try to check out may not exist
+        run_logged(["git", "-C", config.BUNDLE_DIR, "fetch"], self.logger, "git", check=True, running=self.running_procs)
+
+        #    ASSESSMENT_BUNDLE_BRANCH is intended to be passed to Earthmover but we
+        # can utilize it to enable non-main code to be run if the app dictates it
+        subprocess.run(
+            ["git", "-C", config.BUNDLE_DIR, "checkout", os.environ["ASSESSMENT_BUNDLE_BRANCH"]]
+        ).check_returncode()
+
+        run_logged(["git", "-C", config.BUNDLE_DIR, "pull", "--ff-only"], self.logger, "git", check=True, running=self.running_procs)
+
+    def refresh_bundle_code_shallow(self):
+        """Check out only the commit and files this job needs
+
+        The branch is resolved to a commit SHA first. If the checkout is already at that commit there is
+        nothing to fetch; otherwise just that commit is fetched, without history or blobs outside the
+        sparse checkout (the student ID wrapper and shared packages, plus the job's bundle).
+        """
+        branch = os.environ["ASSESSMENT_BUNDLE_BRANCH"]
+        sha = self.resolve_bundle_branch(branch)
+        if sha is None:
+            # not a branch name, e.g. a tag or commit SHA; let the full refresh handle it
+            self.logger.info(f"could not resolve bundle branch {branch} on the remote; falling back to a full refresh")
+            self.refresh_bundle_code_full()
+            return
+
+        sparse_paths = config.BUNDLE_SPARSE_PATHS + [self.bundle_path]
+        subprocess.run(
+            ["git", "-C", config.BUNDLE_DIR, "sparse-checkout", "set", *sparse_paths]
+        ).check_returncode()
+
+        if git_head(config.BUNDLE_DIR) == sha:
+            self.logger.info(f"bundle code already at {branch} ({sha}); skipping fetch")
+        else:
+            run_logged(
+                ["git", "-C", config.BUNDLE_DIR, "fetch", "--depth", "1", "--filter=blob:none", "origin", branch],
+                self.logger, "git", check=True, running=self.running_procs,
+            )
+            # --force discards local edits to the previous checkout, e.g. seeds rewritten by map_descriptors()
+            subprocess.run(
+                ["git", "-C", config.BUNDLE_DIR, "checkout", "--force", "-B", branch, "FETCH_HEAD"]
+            ).check_returncode()
+
+    def resolve_bundle_branch(self, branch):
+        """The commit SHA that branch points to on the bundles remote, or None if there is no such branch
+
+        Lookups are cached for BUNDLE_REF_CACHE_SECONDS so that back-to-back jobs on the same branch skip
+        the network entirely.
+        """
+        cache_path = os.path.join(config.CACHE_DIR, "bundle-refs.json")
+        try:
+            with open(cache_path) as f:
+                refs = json.load(f)
+        except (FileNotFoundError, ValueError):
+            refs = {}
+
+        cached = refs.get(branch)
+        if cached and time.time() - cached["resolved_at"] < config.BUNDLE_REF_CACHE_SECONDS:
+            return cached["sha"]
+
+        ls_remote = run_logged(
+            ["git", "-C", config.BUNDLE_DIR, "ls-remote", "origin", f"refs/heads/{branch}"],
+            self.logger, "git", check=True, running=self.running_procs,
         )
+        lines = ls_remote.stdout.split()
+        sha = lines[0] if lines else None
+        if sha:
+            refs[branch] = {"sha": sha, "resolved_at": time.time()}
+            os.makedirs(config.CACHE_DIR, exist_ok=True)
+            with open(cache_path, "w") as f:
+                json.dump(refs, f)
+        return sha
+
+    def earthmover_cmd(self, args, check=False, in_process=None):
+        """Thinly wrap our em calls to handle invocation and logging. Returns a CompletedProcess object, or raises CalledProcessError if check is set
+
+        Output is logged as Earthmover produces it; the returned stdout and stderr hold only their tails.
+        in_process overrides the executor-wide EARTHMOVER_IN_PROCESS setting for this command
+        """
+        if in_process is None:
+            in_process = self.earthmover_in_process
+
+        if in_process:
+            em = run_earthmover(args, self.logger)
+            if check:
+                em.check_returncode()
+        else:
+            em = run_logged(args, self.logger, "earthmover", check=check, running=self.running_procs)
 
-        # Log stdout and stderror if they exist
-        if em.stdout:
-            self.logger.info(f"earthmover stdout: {em.stdout}")
-        if em.stderr:
-            self.logger.info(f"earthmover stderr: {em.stderr}")
+        return em
 
-        return em       
+    def prepare_bundle(self):
+        """Install bundle dependencies, then customize the installed assessment package for this job"""
+        self.earthmover_deps()
+        if self.send_to_ods and self.local_mode:
+            self.modify_local_lightbeam()
+        self.map_descriptors()
 
     def earthmover_deps(self):
-        """Create the Earthmover runtime environment by installing bundle dependencies"""
-        self.set_action(action.EARTHMOVER_DEPS)
+        """Create the Earthmover runtime environment by installing bundle dependencies
+
+        Installed packages are cached by a fingerprint of everything that determines them, so a job whose
+        dependencies match an earlier job's copies that tree instead of running deps again.
+        """
+        packages_dir = os.path.join(self.wrapper_project, "packages")
+        cached_dir = os.path.join(config.CACHE_DIR, "deps", self.earthmover_deps_fingerprint())
+        if os.path.isdir(cached_dir):
+            self.logger.info(f"reusing cached earthmover packages from {cached_dir}")
+            shutil.rmtree(packages_dir, ignore_errors=True)
+            shutil.copytree(cached_dir, packages_dir, symlinks=True)
+            return
 
         try:
             cmd=["earthmover", "-c", self.wrapper_earthmover, "deps"]
-            self.earthmover_cmd(args=cmd, check=True)
+            # always a separate process: deps runs alongside other stages, and Earthmover's Python API
+            # changes the working directory out from under them
+            self.earthmover_cmd(cmd, check=True, in_process=False)
         except subprocess.CalledProcessError:
             self.error = error.EarthmoverDepsError()
             raise
 
+        # copy to a temporary name first so an interrupted copy is never mistaken for a cache entry
+        os.makedirs(os.path.dirname(cached_dir), exist_ok=True)
+        tmp_dir = f"{cached_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.copytree(packages_dir, tmp_dir, symlinks=True)
+        os.rename(tmp_dir, cached_dir)
+        prune_cache_entries(os.path.dirname(cached_dir), config.DEPS_CACHE_MAX_ENTRIES)
+
+    def earthmover_deps_fingerprint(self):
+        """Hash of the inputs to `earthmover deps`: the wrapper's package specs and the bundle code they resolve to"""
+        fingerprint = hashlib.sha256()
+        fingerprint.update(self.bundle_commit.encode())
+        with open(self.wrapper_earthmover, "rb") as f:
+            fingerprint.update(f.read())
+        # the wrapper templates its assessment package's location from these
+        for env_name in ["ASSESSMENT_BUNDLE", "ASSESSMENT_BUNDLE_BRANCH"]:
+            fingerprint.update(f"{env_name}={os.environ.get(env_name)}\n".encode())
+        return fingerprint.hexdigest()
+
     def modify_local_lightbeam(self):
         """Disable SSL checking in Lightbeam so that it can communicate with a locally-running ODS"""
         subprocess.run(
@@ -287,8 +635,8 @@ class JobExecutor:
 
     def get_student_roster(self):
         """Download a list of students so they can be used to match IDs in the initial Earthmover run"""
-        self.set_action(action.GET_ROSTER)
-
+        # ID statistics are gathered while the roster lands on disk, whichever source it comes from
+        self.roster_stats = RosterIdStats()
         if self.send_to_ods:
             # Case 1: initially attempt to match on current year;
             #         leave open the cross-year option if we take another pass
@@ -296,7 +644,7 @@ class JobExecutor:
         elif self.cross_year_match_available:
             # Case 2: not sending to this year's ODS but we have access to EDU;
             #         only running Earthmover once with cross-year roster
-            self.get_roster_from_edu(artifact.ROSTER.path)
+            self.get_roster_from_edu(artifact.ROSTER.path, self.roster_stats, cancel=self.stage_cancel)
         else:
             # Case 3: not sending to this year's ODS and EDU is unavailable;
             #         only running Earthmover once with uploaded roster
@@ -304,13 +652,19 @@ class JobExecutor:
 
         self.upload_artifact(artifact.ROSTER)
 
-    def get_roster_from_edu(self, dest_path):
-        """Query EDU via the Runway app and stream cross-year roster data into the given JSONL file"""
+    def get_roster_from_edu(self, dest_path, tee=None, cancel=None):
+        """Query EDU via the Runway app and stream cross-year roster data into the given JSONL file
+
+        If tee is given, it is fed the roster bytes as they are written (see RosterIdStats). Setting the
+        cancel Event, if given, stops the download
+        """
         self.logger.info(f"cross-year pass: streaming cross-year roster")
         dest_path = os.path.abspath(dest_path)
         os.makedirs(os.path.dirname(dest_path), exist_ok=True)
         try:
-            stream_to_file(self.conn, self.cross_year_roster_url, dest_path)
+            num_bytes, seconds, resumes = stream_to_file(self.conn, self.cross_year_roster_url, dest_path, tee=tee, cancel=cancel)
+            self.logger.info(f"cross-year pass: streamed {num_bytes} bytes in {seconds:.2f} seconds "
+                             f"({num_bytes / 2**20 / max(seconds, 0.001):.1f} MiB/s, resumed {resumes} times)")
         except requests.exceptions.RequestException:
             self.error = error.CrossYearRosterFetchError()
             raise
@@ -318,13 +672,30 @@ class JobExecutor:
         if os.stat(dest_path).st_size == 0:
             self.error = error.CrossYearRosterFetchError()
             raise ValueError("Cross-year roster is empty")
+        self.timings.add_bytes(os.stat(dest_path).st_size)
 
     def get_roster_from_ods(self):
-        """Fetch student roster from the ODS via lightbeam"""
+        """Fetch student roster from the ODS via lightbeam, or reuse one recently fetched from the same ODS"""
+        cache_key = None
+        if self.roster_cache.enabled:
+            cache_key = self.roster_cache.key(
+                os.environ["EDFI_API_BASE_URL"], os.environ["EDFI_API_CLIENT_ID"], os.environ.get("API_YEAR")
+            )
+            self.roster_cache_key = cache_key
+            cached_path = self.roster_cache.lookup(cache_key)
+            if cached_path:
+                self.logger.info(f"reusing roster fetched from this ODS within the last {self.roster_cache.ttl_seconds} seconds")
+                # leave the directories as a fetch would have
+                os.rename(self.output_dir, config.ROSTER_DOWNLOAD_DIR)
+                link_or_copy(cached_path, artifact.ROSTER.path)
+                self.roster_stats = scan_roster_file(artifact.ROSTER.path)
+                return
+
         try:
-            subprocess.run(
-                ["lightbeam", "-c", self.assessment_lightbeam, "fetch", "-s", "studentEducationOrganizationAssociations", "-k", "studentIdentificationCodes,educationOrganizationReference,studentReference"]
-            ).check_returncode()
+            run_logged(
+                ["lightbeam", "-c", self.assessment_lightbeam, "fetch", "-s", "studentEducationOrganizationAssociations", "-k", "studentIdentificationCodes,educationOrganizationReference,studentReference"],
+                self.logger, "lightbeam", check=True, running=self.running_procs,
+            )
 
             # in effect: mv output roster-download-dir
             # Because lightbeam uses the same directory for uploads and downloads,
@@ -340,12 +711,31 @@ class JobExecutor:
             self.error = error.MissingOdsRosterError()
             raise
     
-        except subprocess.CalledProcessError:
+        except subprocess.CalledProcessError as e:
             self.error = error.LightbeamFetchError(
-                "studentEducationOrganizationAssociations"
+                "studentEducationOrganizationAssociations", e.stderr
             )
             raise
 
+        self.timings.add_bytes(os.stat(artifact.ROSTER.path).st_size)
+        # lightbeam writes the file itself, so this is the one pass over it
+        self.roster_stats = scan_roster_file(artifact.ROSTER.path)
+
+        if cache_key:
+            self.roster_cache.store(cache_key, artifact.ROSTER.path)
+            prune_cache_entries(self.roster_cache.cache_dir, config.ROSTER_CACHE_MAX_ENTRIES)
+
+    def invalidate_roster_cache(self):
+        """Drop the cached ODS roster once it has left input rows unmatched
+
+        The user is likely to fix the ODS and rerun, and the rerun must fetch the fixed roster
+        """
+        if self.roster_cache_key is None:
+            return
+        self.roster_cache.invalidate(self.roster_cache_key)
+        self.roster_cache_key = None
+        self.logger.info("some input rows did not match the ODS roster; dropped it from the roster cache")
+
     def get_roster_from_s3(self):
         """Download a pre-loaded roster file from S3"""
         self.logger.info(f"downloading roster from {self.roster_file_path}")
@@ -355,46 +745,106 @@ class JobExecutor:
             roster_uri = parse.urlparse(self.roster_file_path, allow_fragments=False)
             bucket = roster_uri.hostname
             key = roster_uri.path.lstrip("/")
-            self.s3.download_file(bucket, key, artifact.ROSTER.path)
+            # the transfer manager retries and resumes interrupted transfers, which a streamed read would not
+            self.s3.download_file(bucket, key, artifact.ROSTER.path, Config=self.s3_transfer_config)
 
             if os.stat(artifact.ROSTER.path).st_size == 0:
                 raise ValueError("Downloaded roster file is empty")
+            self.timings.add_bytes(os.stat(artifact.ROSTER.path).st_size)
 
         except (ValueError, FileNotFoundError):
             self.error = error.MissingOdsRosterError()
             raise
-        except botocore.exceptions.ClientError:
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError, boto3.exceptions.RetriesExceededError):
             self.error = error.InputS3DownloadError(
                 "roster", self.roster_file_path
             )
             raise
 
+        self.roster_stats = scan_roster_file(artifact.ROSTER.path)
+
     def get_input_files(self):
         """Download user-uploaded files from S3"""
-        self.set_action(action.GET_FILES)
-
-        self.input_paths = {}
+        # resolve every source up front so that all downloads can be started at once
+        downloads = {}
         for env_name, path in self.input_sources.items():
             # if allow_fragments is True, paths containing a '#' are incorrectly split
             uri = parse.urlparse(path, allow_fragments=False)
+            # NOTE: there's a world where we don't need to download the file
+            # and we can use something like s3fs to just give Earthmover an
+            # s3 path, but we're not living in that world yet. s3fs seems to
+            # have serious problems and without it, this would require a
+            # change to earthmover itself
+            uri_path = uri.path.lstrip("/")
+            downloads[env_name] = (
+                f"{self.s3_in_path}/{uri_path}",
+                os.path.abspath(localize_s3_path(uri_path)),
+            )
+
+        with ThreadPoolExecutor(max_workers=config.S3_TRANSFER_MAX_WORKERS) as pool:
+            futures = {
+                env_name: pool.submit(self.download_s3_file, self.app_bucket, key, local_path)
+                for env_name, (key, local_path) in downloads.items()
+            }
+
+        # failures are reported in the order the app listed the files, so the error is deterministic
+        self.input_paths = {}
+        for env_name, future in futures.items():
+            key, local_path = downloads[env_name]
             try:
-                # NOTE: there's a world where we don't need to download the file
-                # and we can use something like s3fs to just give Earthmover an
-                # s3 path, but we're not living in that world yet. s3fs seems to
-                # have serious problems and without it, this would require a
-                # change to earthmover itself
-                uri_path = uri.path.lstrip("/")
-                local_path = os.path.abspath(localize_s3_path(uri_path))
-                self.s3.download_file(
-                    self.app_bucket, f"{self.s3_in_path}/{uri_path}", local_path
-                )
-                os.environ[env_name] = local_path
-                self.input_sources[env_name] = {"path": local_path}
+                num_bytes, seconds = future.result()
             except botocore.exceptions.ClientError:
-                self.error = error.InputS3DownloadError(
-                    env_name, f"{self.s3_in_path}/{uri_path}"
-                )
+                self.error = error.InputS3DownloadError(env_name, key)
                 raise
+            self.logger.info(f"downloaded input {env_name}: {num_bytes} bytes in {seconds:.2f} seconds")
+            self.timings.add_bytes(num_bytes)
+            os.environ[env_name] = local_path
+            self.input_sources[env_name] = {"path": local_path}
+
+        if self.transcode_input_enabled:
+            self.transcode_input()
+
+    def transcode_input(self):
+        """Decode the input file once with the encoding chosen for it, and have every later step read a UTF-8 copy
+
+        Without this, each Earthmover pass decodes the file again with a non-default encoding, and a wrong
+        guess is only found out by a failed run and a Latin-1 retry. Only delimited text files are
+        transcoded, and a file that is already UTF-8 is left alone.
+        """
+        path = self.input_sources["INPUT_FILE"]["path"]
+        if os.path.splitext(path)[1].lower() not in config.TRANSCODE_INPUT_EXTENSIONS:
+            return
+        self.check_input_encoding()
+        encoding = self.input_sources["INPUT_FILE"]["run_encoding"]
+        if encoding is None:
+            return
+
+        base, extension = os.path.splitext(path)
+        utf8_path = f"{base}.utf-8{extension}"
+        start = time.monotonic()
+        try:
+            transcode_to_utf8(path, utf8_path, encoding)
+        except UnicodeDecodeError as e:
+            # the pre-flight check makes this unlikely; Earthmover gets the original to deal with as usual
+            self.logger.warning(f"input file does not fully decode as {encoding} ({e}); leaving it as it is")
+            os.remove(utf8_path)
+            return
+        self.job_files.append(utf8_path)
+        self.logger.info(f"transcoded input file from {encoding} to UTF-8 in {time.monotonic() - start:.2f} seconds")
+
+        # the copy still describes the user's file, but Earthmover now reads it with its default encoding
+        guess, _ = self.encoding_cache[encoding_cache_key(path)]
+        self.encoding_cache[encoding_cache_key(utf8_path)] = (guess, None)
+        os.environ["INPUT_FILE"] = utf8_path
+        self.input_sources["INPUT_FILE"]["path"] = utf8_path
+        self.check_input_encoding()
+
+    def download_s3_file(self, bucket, key, local_path):
+        """Download one S3 object to local_path. Returns the number of bytes written and the seconds it took"""
+        start = time.monotonic()
+        self.job_files.append(local_path)
+        self.s3.download_file(bucket, key, local_path, Config=self.s3_transfer_config)
+        return os.stat(local_path).st_size, time.monotonic() - start
 
     def map_descriptors(self):
         """Replace assessment bundle seed files' Ed-Fi descriptors with custom values"""
@@ -443,9 +893,17 @@ class JobExecutor:
         os.environ["EDFI_STUDENT_ID_TYPES"] = ",".join(self.distinct_id_types)
         self.logger.info(f"Student ID types in Ed-Fi roster: {os.environ['EDFI_STUDENT_ID_TYPES']}")
 
+        self.probe_match_rate()
+        if self.cross_year_single_pass and self.send_to_ods and self.cross_year_match_available:
+            self.output_sets = self.single_pass_cross_year()
+            self.upload_artifact(artifact.MATCH_RATES)
+            return
+
         self.earthmover_run(artifact.EM_RESULTS.path)
         self.upload_artifact(artifact.EM_RESULTS)
         self.record_highest_match_rate()
+        if self.num_unmatched_students != 0:
+            self.invalidate_roster_cache()
 
         self.output_sets = [OutputSet(
             local_dir=self.output_dir,
@@ -468,6 +926,7 @@ class JobExecutor:
         # If the conditions for a second pass are not met
         # fall back to our typical process and enforce the match rate threshold
         else:
+            self.discard_cross_year_prefetch()
             self.enforce_match_threshold()
 
         self.upload_artifact(artifact.MATCH_RATES)
@@ -475,25 +934,32 @@ class JobExecutor:
     def earthmover_run(self, results_path):
         """Compile and run Earthmover into the given results directory."""
         self.check_input_encoding()
-        if self.input_sources["INPUT_FILE"]["is_plausible_non_utf8"]:
-            encoding = str.lower(self.input_sources["INPUT_FILE"]["encoding"])
-        else:
-            encoding = None
+        encoding = self.input_sources["INPUT_FILE"]["run_encoding"]
         encoding_args = ["--set", "sources.input.encoding", encoding] if encoding else []
         if encoding:
             self.logger.info(f"using input encoding: {encoding}")
 
         fatal = False
         try:
-            cmd = ["earthmover", "-c", self.wrapper_earthmover, "compile"]
-            em = self.earthmover_cmd(args=cmd, capture_output=True, text=True)
-            em.check_returncode()
+            compile_marker = self.earthmover_compile_marker()
+            if os.path.exists(compile_marker):
+                self.logger.info("earthmover project unchanged since its last successful compile; skipping compile")
+                # recently used markers are the ones pruning keeps
+                os.utime(compile_marker)
+            else:
+                cmd = ["earthmover", "-c", self.wrapper_earthmover, "compile"]
+                em = self.earthmover_cmd(cmd)
+                em.check_returncode()
+                os.makedirs(os.path.dirname(compile_marker), exist_ok=True)
+                open(compile_marker, "w").close()
+                prune_cache_entries(os.path.dirname(compile_marker), config.COMPILE_CACHE_MAX_ENTRIES)
 
             # attempt no. 1
-            cmd = ["earthmover", "-c", self.wrapper_earthmover, "run", "--results-file", results_path]
-            cmd.extend(encoding_args)
-            em = self.earthmover_cmd(args=cmd, capture_output=True, text=True)
-            em.check_returncode()
+            if not self.earthmover_run_sharded(results_path, encoding_args):
+                cmd = ["earthmover", "-c", self.wrapper_earthmover, "run", "--results-file", results_path]
+                cmd.extend(encoding_args)
+                em = self.earthmover_cmd(cmd)
+                em.check_returncode()
 
         except subprocess.CalledProcessError as err:
             self.logger.error("earthmover encountered an error")
@@ -502,11 +968,13 @@ class JobExecutor:
             #    yes it's brittle to check the error against a string like this, but this message hasn't
             # changed since 2007(!) -> https://github.com/python/cpython/blame/main/Objects/exceptions.c
             if err.stderr and "codec can't decode" in err.stderr and encoding != "iso-8859-1":
-                self.logger.error(f"Failed to read file with {encoding} encoding. Retrying with Latin1...")
+                # the pre-flight check should make this rare; count it so we can tell if it isn't
+                self.encoding_fallbacks += 1
+                self.logger.error(f"Failed to read file with {encoding} encoding. Retrying with Latin1... (encoding fallbacks this job: {self.encoding_fallbacks})")
                 try:
                     # attempt no. 2 - need a new em object to overwrite the decoding error
                     cmd = ["earthmover", "-c", self.wrapper_earthmover, "run", "--results-file", results_path, "--set", "sources.input.encoding", "iso-8859-1"]
-                    em = self.earthmover_cmd(args=cmd, capture_output=True, text=True)
+                    em = self.earthmover_cmd(cmd)
                     em.check_returncode()
                     
                     fatal = False # if we made it this far, we can abort the shutdown
@@ -527,6 +995,142 @@ class JobExecutor:
             # generic exception that will be caught, with em.stderr reported as the stacktrace
             raise Exception(em.stderr)
 
+    def earthmover_run_sharded(self, results_path, encoding_args):
+        """Run Earthmover on shards of a large input at once, merging their output as if the input had run whole
+
+        Returns False when the input isn't sharded, or when the shards fail or disagree on which ID column
+        matches best (each shard picks its own); the input should then be run whole, which also deals with
+        any failure as usual. Shards always run as separate processes, since each needs its own environment.
+        """
+        input_path = self.input_sources["INPUT_FILE"]["path"]
+        if os.path.splitext(input_path)[1].lower() not in config.EARTHMOVER_SHARD_EXTENSIONS:
+            return False
+        input_size = os.stat(input_path).st_size
+        num_shards = min(self.earthmover_shards, input_size // self.earthmover_shard_min_bytes)
+        if num_shards < 2:
+            return False
+        header_rows = input_header_rows([self.wrapper_earthmover, os.path.join(self.assessment_project, "earthmover.yaml")])
+        if header_rows is None:
+            self.logger.info("sharded earthmover: could not tell how the input source reads its header; running it whole")
+            return False
+        if header_rows != 1:
+            self.logger.info(f"sharded earthmover: the input source reads {header_rows} header rows; running it whole")
+            return False
+        memory = available_memory()
+        if memory is not None:
+            roster_size = os.stat(os.environ["EDFI_ROSTER_FILE"]).st_size
+            fits = int(memory // (config.EARTHMOVER_SHARD_MEMORY_FACTOR * (roster_size + input_size / num_shards)))
+            if fits < num_shards:
+                self.logger.info(f"sharded earthmover: only {fits} shards fit in {memory} bytes of available memory")
+                num_shards = fits
+                if num_shards < 2:
+                    return False
+
+        shard_dir = os.path.abspath(config.EARTHMOVER_SHARD_DIR)
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        start = time.monotonic()
+        try:
+            shards = split_input(input_path, self.input_sources["INPUT_FILE"]["run_encoding"] or "utf-8", num_shards, shard_dir)
+        except UnicodeError as e:
+            self.logger.warning(f"sharded earthmover: could not split the input ({e}); running it whole")
+            shutil.rmtree(shard_dir, ignore_errors=True)
+            return False
+        self.logger.info(f"sharded earthmover: split {input_path} into {len(shards)} shards in {time.monotonic() - start:.2f} seconds")
+
+        running = set()
+        def run_shard(shard):
+            env = {
+                **os.environ,
+                "INPUT_FILE": shard.input_path,
+                "OUTPUT_DIR": shard.output_dir,
+                "TEMPORARY_DIRECTORY": shard.dir,
+            }
+            cmd = ["earthmover", "-c", self.wrapper_earthmover, "run", "--results-file", shard.results_path]
+            cmd.extend(encoding_args)
+            return run_logged(cmd, self.logger, f"earthmover shard {shard.index}", env=env, running=running)
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            try:
+                runs = list(pool.map(run_shard, shards))
+            except BaseException:
+                # e.g. the job timed out; stop the other shards rather than wait for them
+                for proc in list(running):
+                    proc.kill()
+                raise
+
+        failed = [(shard, em) for shard, em in zip(shards, runs) if em.returncode != 0]
+        winners = {winning_match(shard) for shard in shards} - {None}
+        if failed:
+            shard, em = failed[0]
+            self.logger.warning(f"sharded earthmover: {len(failed)} of {len(shards)} shards failed (shard {shard.index}: {em.stderr.strip()[-500:]}); running the input whole")
+        elif len(winners) > 1:
+            self.logger.warning(f"sharded earthmover: shards matched best on different ID columns ({sorted(winners)}); running the input whole")
+        else:
+            merge_shards(shards, self.output_dir, results_path)
+            self.logger.info(f"sharded earthmover: ran and merged {len(shards)} shards in {time.monotonic() - start:.2f} seconds")
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        return not failed and len(winners) <= 1
+
+    def probe_match_rate(self):
+        """Estimate the first pass's match rate from a sample of the input, and fail now if it clearly won't suffice
+
+        A poor first pass only fails the job when no cross-year pass can follow it, so that is the only case
+        that fails early; otherwise the estimate just predicts whether the cross-year pass will be needed.
+        """
+        self.match_estimate = None
+        input_path = self.input_sources["INPUT_FILE"]["path"]
+        if os.path.splitext(input_path)[1].lower() not in config.MATCH_PROBE_EXTENSIONS:
+            self.logger.debug("match probe: input is not a delimited text file; skipping")
+            return
+
+        self.check_input_encoding()
+        start = time.monotonic()
+        id_columns = [c for c in os.environ.get("POSSIBLE_STUDENT_ID_COLUMNS", "").split(",") if c]
+        estimate = estimate_match_rate(
+            artifact.ROSTER.path, input_path, self.input_sources["INPUT_FILE"]["run_encoding"] or "utf-8",
+            config.MATCH_PROBE_SAMPLE_ROWS, id_columns, config.MATCH_PROBE_SLICES,
+        )
+        if estimate is None or estimate.sample_rows < config.MATCH_PROBE_MIN_ROWS:
+            self.logger.debug("match probe: too few input rows to estimate a match rate")
+            return
+        self.match_estimate = estimate
+        self.logger.info(f"match probe: estimated match rate {estimate.match_rate:.3f} on {estimate.column} ({estimate.id_type} ID) from {estimate.sample_rows} rows in {time.monotonic() - start:.2f} seconds")
+
+        if self.send_to_ods and self.cross_year_match_available:
+            if estimate.match_rate < 1.0:
+                self.logger.info("match probe: some students are likely to need the cross-year pass")
+            return
+
+        # a safety margin for however the probe's exact matching differs from the wrapper's
+        if estimate.match_rate < config.REQUIRED_ID_MATCH_RATE * config.MATCH_PROBE_FAIL_FRACTION:
+            # as in report_unmatched_students, report the "actual" ID when studentUniqueId replicates one
+            id_type = estimate.id_type
+            if id_type == "studentUniqueId" and self.stu_unique_id_in_roster:
+                id_type = self.stu_unique_id_in_roster
+            self.error = error.InsufficientMatchesError(
+                estimate.match_rate, config.REQUIRED_ID_MATCH_RATE,
+                estimate.column or "N/A", id_type or "N/A",
+            )
+            self.invalidate_roster_cache()
+            raise ValueError(f"insufficient ID matches to continue (estimated rate {estimate.match_rate} from a sample of {estimate.sample_rows} rows, far below required {config.REQUIRED_ID_MATCH_RATE})")
+
+    def earthmover_compile_marker(self):
+        """Path of the file recording a successful compile of the project as currently configured
+
+        A compile only validates the project configuration, so its result depends on the bundle code,
+        the project YAML, and the environment variables that are templated into it; the data files
+        Earthmover will read don't matter.
+        """
+        fingerprint = hashlib.sha256()
+        fingerprint.update(self.bundle_commit.encode())
+        for yaml_path in [self.wrapper_earthmover, os.path.join(self.assessment_project, "earthmover.yaml")]:
+            if os.path.exists(yaml_path):
+                with open(yaml_path, "rb") as f:
+                    fingerprint.update(f.read())
+        for env_name in sorted(set(config.EARTHMOVER_COMPILE_ENV_VARS + self.input_param_names)):
+            fingerprint.update(f"{env_name}={os.environ.get(env_name)}\n".encode())
+        return os.path.join(config.CACHE_DIR, "compile", fingerprint.hexdigest())
+
     def cross_year_pass(self, primary):
         """Run a second Earthmover pass on unmatched students using a cross-year roster in an attempt to match more students."""
 
@@ -535,7 +1139,7 @@ class JobExecutor:
         primary.local_dir = first_run_output_dir
         os.mkdir(self.output_dir)
 
-        self.get_roster_from_edu(config.CROSS_YEAR_ROSTER_PATH)
+        self.fetch_cross_year_roster()
         artifact.CROSS_YEAR_ROSTER.needs_upload = True
         self.upload_artifact(artifact.CROSS_YEAR_ROSTER)
         os.environ["EDFI_ROSTER_FILE"] = os.path.abspath(config.CROSS_YEAR_ROSTER_PATH)
@@ -600,28 +1204,192 @@ class JobExecutor:
             em_results_path=artifact.EM_RESULTS_X_YEAR.path,
         )
 
+    def single_pass_cross_year(self):
+        """Match against the current-year and cross-year rosters in one Earthmover pass, and split its output into both output sets
+
+        An alternative to a first pass followed by cross_year_pass(); see single_pass.py. The outcome is
+        meant to be the same: ODS students' records are sent to the ODS, the records of students only EDU
+        knows are sideloaded, and the match rate threshold is applied as the two passes would apply it.
+
+        One difference remains. When the first of the two passes meets the threshold, the cross-year pass
+        only matches on the ID column and type that won it. Here every row is matched on the column and type
+        that did best against both rosters together. The two only differ when that isn't the column and type
+        that would have done best against the ODS roster alone.
+        """
+        self.fetch_cross_year_roster()
+        union_roster_path = os.path.abspath(config.UNION_ROSTER_PATH)
+        self.job_files.append(union_roster_path)
+        ods_ids, edu_records = union_rosters(artifact.ROSTER.path, artifact.CROSS_YEAR_ROSTER.path, union_roster_path)
+        self.logger.info(f"single-pass cross-year matching: {len(ods_ids)} ODS students, plus {edu_records} cross-year records for other students")
+        os.environ["EDFI_ROSTER_FILE"] = union_roster_path
+
+        self.earthmover_run(artifact.EM_RESULTS.path)
+        self.upload_artifact(artifact.EM_RESULTS)
+        self.record_highest_match_rate()
+
+        first_run_output_dir = os.path.abspath(config.OUTPUT_DIR_FIRST_RUN)
+        counts = split_output(self.output_dir, first_run_output_dir, self.output_dir, ods_ids)
+        ods_records = sum(c["ods"] for c in counts.values())
+        non_ods_records = sum(c["non_ods"] for c in counts.values())
+        self.logger.info(f"single-pass cross-year matching: {ods_records} student records for the ODS, {non_ods_records} to sideload")
+        if self.num_unmatched_students != 0 or non_ods_records:
+            # rows that only matched cross-year students count too: those students are missing from the ODS
+            self.invalidate_roster_cache()
+
+        # The two passes judge the threshold by the first pass, which only matched ODS students: its match
+        # rate is the number of input rows matched to an ODS student, out of all input rows
+        met_initial_threshold = self.ods_match_rate(counts) >= config.REQUIRED_ID_MATCH_RATE
+
+        output_sets = [OutputSet(
+            local_dir=first_run_output_dir,
+            s3_subdir="ods",
+            sent_to_ods=True,
+            em_results_path=artifact.EM_RESULTS.path,
+            lb_send_results_path=artifact.LB_SEND_RESULTS.path,
+        )]
+        if met_initial_threshold and self.num_unmatched_students == 0 and non_ods_records == 0:
+            # every student was in the ODS, so there would have been no cross-year pass
+            self.logger.info("single-pass cross-year matching: all input records matched ODS students")
+            return output_sets
+
+        if not met_initial_threshold:
+            # without a good first pass, the cross-year pass would have rematched the whole input
+            # against all ID types, and the threshold applies to that
+            self.enforce_match_threshold()
+            sideload_ods_students(first_run_output_dir, self.output_dir)
+
+        artifact.CROSS_YEAR_ROSTER.needs_upload = True
+        self.upload_artifact(artifact.CROSS_YEAR_ROSTER)
+        write_split_results(artifact.EM_RESULTS.path, artifact.EM_RESULTS_X_YEAR.path, self.output_dir)
+        artifact.EM_RESULTS_X_YEAR.needs_upload = True
+        self.upload_artifact(artifact.EM_RESULTS_X_YEAR)
+        self.logger.warning(f"single-pass cross-year matching: {self.num_unmatched_students} unmatched students remain")
+
+        output_sets.append(OutputSet(
+            local_dir=self.output_dir,
+            s3_subdir="non-ods",
+            sent_to_ods=False,
+            em_results_path=artifact.EM_RESULTS_X_YEAR.path,
+        ))
+        return output_sets
+
+    def ods_match_rate(self, counts):
+        """The match rate a first pass against the ODS roster alone would have had, given split_output()'s counts
+
+        Each matched input row yields one record of the student assessments destination, so the rows that
+        matched ODS students are its ODS records. Without that destination, the share of all student records
+        that went to ODS students stands in for the share of matched rows.
+        """
+        match_rates = load_match_rates()
+        if not match_rates:
+            return 0.0
+        num_rows = int(match_rates[0]["num_rows"])
+        destination = counts.get(config.STUDENT_ASSESSMENTS_DESTINATION)
+        if destination is not None:
+            return destination["ods"] / num_rows if num_rows else 0.0
+
+        self.logger.warning(f"single-pass cross-year matching: no {config.STUDENT_ASSESSMENTS_DESTINATION} output; estimating the ODS match rate from all student records")
+        student_records = sum(c["ods"] + c["non_ods"] for c in counts.values())
+        ods_records = sum(c["ods"] for c in counts.values())
+        return self.highest_match_rate * ods_records / student_records if student_records else 0.0
+
+    def start_cross_year_prefetch(self):
+        """Start streaming the cross-year roster in the background, betting that the cross-year pass will need it
+
+        Most jobs that can take a cross-year pass do, so the download overlaps the first pass instead of
+        following it. Errors are held for fetch_cross_year_roster() to deal with.
+        """
+        self.prefetch_cancel = threading.Event()
+        self.prefetch_result = {}
+        # resolved now: in-process Earthmover may change the working directory while this runs
+        dest_path = artifact.CROSS_YEAR_ROSTER.path
+        url = self.cross_year_roster_url
+        # the main thread keeps using self.conn meanwhile, and requests sessions aren't guaranteed to be thread-safe
+        conn = make_app_session(self.conn.headers)
+
+        def prefetch():
+            try:
+                self.prefetch_result["stats"] = stream_to_file(conn, url, dest_path, cancel=self.prefetch_cancel)
+            except BaseException as e:
+                self.prefetch_result["error"] = e
+            finally:
+                conn.close()
+
+        self.logger.info("cross-year pass: prefetching cross-year roster in the background")
+        self.prefetch_thread = threading.Thread(target=prefetch, daemon=True, name="cross-year-prefetch")
+        self.prefetch_thread.start()
+
+    def fetch_cross_year_roster(self):
+        """Put the cross-year roster in place, from the prefetch if it succeeded and otherwise by fetching it now"""
+        if self.prefetch_thread:
+            self.prefetch_thread.join()
+            self.prefetch_thread = None
+            prefetch_error = self.prefetch_result.get("error")
+            if prefetch_error is None and os.stat(artifact.CROSS_YEAR_ROSTER.path).st_size > 0:
+                num_bytes, seconds, resumes = self.prefetch_result["stats"]
+                self.logger.info(f"cross-year pass: using prefetched roster ({num_bytes} bytes in {seconds:.2f} seconds, resumed {resumes} times)")
+                self.timings.add_bytes(num_bytes)
+                return
+            self.logger.warning(f"cross-year pass: roster prefetch failed ({repr(prefetch_error) if prefetch_error else 'empty roster'}); fetching it again")
+
+        self.get_roster_from_edu(config.CROSS_YEAR_ROSTER_PATH)
+
+    def discard_cross_year_prefetch(self):
+        """Cancel a prefetch whose roster went unused, and delete whatever it downloaded"""
+        if not self.prefetch_thread:
+            return
+        self.prefetch_cancel.set()
+        self.prefetch_thread.join(config.PREFETCH_CANCEL_WAIT_SECONDS)
+        if self.prefetch_thread.is_alive():
+            self.logger.warning("cross-year roster prefetch did not stop in time; abandoning it")
+            self.reusable = False
+        self.prefetch_thread = None
+        if os.path.exists(artifact.CROSS_YEAR_ROSTER.path):
+            os.remove(artifact.CROSS_YEAR_ROSTER.path)
+
     def check_input_encoding(self):
         """Determine whether assessment file should be loaded with a non-UTF-8 encoding"""
         #    right now we only support encoding changes on the primary input file,
         # which is called "input" in Runway-ready bundles. In order to modify the
         # encodings of other files, we would have to know their name inside earthmover.yaml,
         # which for now we are not going to attempt to do.
-        detector = UniversalDetector()
-        start = time.monotonic()
-        for line in open(self.input_sources["INPUT_FILE"]["path"], 'rb'):
-            detector.feed(line)
-            if detector.done:
-                break
-            elif time.monotonic() - start > config.MAX_ENCODING_DETECTION_SECONDS:
-                self.logger.warning(f"Encoding detection timed out after {config.MAX_ENCODING_DETECTION_SECONDS} seconds - defaulting to UTF-8")
-                break
-        chardet_runtime = time.monotonic() - start
-        result = detector.close()
-        self.input_sources["INPUT_FILE"]["encoding"] = result["encoding"]
-        self.input_sources["INPUT_FILE"]["is_plausible_non_utf8"] = result["encoding"] in config.PLAUSIBLE_NON_UTF8_ENCODINGS
+        path = self.input_sources["INPUT_FILE"]["path"]
+        cache_key = encoding_cache_key(path)
+        if cache_key not in self.encoding_cache:
+            guess = detect_encoding(path, config.ENCODING_DETECTION_SAMPLE_BYTES, config.MAX_ENCODING_DETECTION_SECONDS)
+            if guess.timed_out:
+                self.logger.warning(f"Encoding detection timed out after {config.MAX_ENCODING_DETECTION_SECONDS} seconds - using best guess so far")
+            self.logger.debug(f"encoding detection ({guess.method}) examined {guess.bytes_examined} bytes in {guess.seconds} seconds")
+            self.encoding_cache[cache_key] = (guess, self.preflight_input_encoding(path, guess))
+        guess, run_encoding = self.encoding_cache[cache_key]
+
+        self.input_sources["INPUT_FILE"]["encoding"] = guess.encoding
+        self.input_sources["INPUT_FILE"]["encoding_bytes_examined"] = guess.bytes_examined
+        self.input_sources["INPUT_FILE"]["is_plausible_non_utf8"] = guess.encoding in config.PLAUSIBLE_NON_UTF8_ENCODINGS
+        # what Earthmover will actually be told to use; None means its default, UTF-8
+        self.input_sources["INPUT_FILE"]["run_encoding"] = run_encoding
 
         self.logger.info(f"encoding detected for input file: {self.input_sources['INPUT_FILE']['encoding']}")
-        self.logger.debug(f"encoding detection ran for {chardet_runtime} seconds")
+
+    def preflight_input_encoding(self, path, guess):
+        """Confirm that the input file decodes with the detected encoding before Earthmover tries it
+
+        Returns the encoding Earthmover should use, or None for its default (UTF-8). If the detected encoding
+        doesn't work, UTF-8 and then Latin-1 are tried, mirroring earthmover_run's retry.
+        """
+        detected = str.lower(guess.encoding) if guess.encoding in config.PLAUSIBLE_NON_UTF8_ENCODINGS else "utf-8"
+        candidates = list(dict.fromkeys([detected, "utf-8", "iso-8859-1"]))
+
+        start = time.monotonic()
+        chosen = first_decodable(path, candidates, config.ENCODING_PREFLIGHT_CHUNK_BYTES)
+        self.logger.debug(f"encoding pre-flight check ran for {time.monotonic() - start} seconds")
+        if chosen is None:
+            # Latin-1 decodes any byte sequence, so this is only reachable for odd candidates; let Earthmover decide
+            chosen = detected
+        elif chosen != detected:
+            self.logger.warning(f"input file does not decode as {detected}; using {chosen} instead")
+
+        return None if chosen == "utf-8" else chosen
 
     def unpack_id_types(self):
         """Use descriptors that exist in the roster to help the user assign IDs to unmatched students
@@ -639,67 +1407,16 @@ class JobExecutor:
         flag whether there is such a replication so that Runway knows which ID type to report to the user
         even when it is not used for ID crosswalking directly.
         """
-        roster_records = []
-        with open(artifact.ROSTER.path, 'r', encoding='utf-8') as f:
-            for line in f:
-                roster_records.append(json.loads(line.strip()))
-
-        id_types = {}
-        for record in roster_records:
-            try:
-                for id_code in record["studentIdentificationCodes"]:
-                    # a given roster record may have several ID descriptors with different values
-                    # using split()[-1] here because it's possible for these ID types to have a full descriptor URI, and also for them to be bare
-                    id_type = id_code["studentIdentificationSystemDescriptor"].split("#")[-1]
-                    if id_type not in id_types:
-                        id_types[id_type] = {
-                            "stu_id_matches": 0,
-                            "non_nulls": 0
-                        }
-                    if str(id_code["identificationCode"]) == str(record["studentReference"]["studentUniqueId"]):
-                        id_types[id_type]["stu_id_matches"] += 1
-                    if id_code["identificationCode"]:
-                        id_types[id_type]["non_nulls"] += 1
-            except KeyError:
-                # any malformed or incomplete stu-ed-org record doesn't need to be counted for this
-                pass
+        # counted while the roster was fetched; see get_student_roster()
+        stats = self.roster_stats
 
         # first thing's done - we know all types of IDs represented in the roster
-        self.distinct_id_types = set(id_types.keys())
+        self.distinct_id_types = stats.distinct_id_types()
         logging.info(f"distinct_id_types: {self.distinct_id_types}")
 
         # now we check for sufficient overlap between these IDs and studentUniqueId
-        not_null_threshold = 0.5
-        too_many_nulls_ids = []
-        for t in id_types.keys():
-            # what fraction of all the records have this ID?
-            id_types[t]["pct_non_nulls"] = id_types[t]["non_nulls"] / len(roster_records)
-            if id_types[t]["pct_non_nulls"] < not_null_threshold:
-                too_many_nulls_ids.append(t)
-            else:
-                # of the records that have this ID, what fraction of the ID's values match
-                id_types[t]["pct_matches"] = id_types[t]["stu_id_matches"] / id_types[t]["non_nulls"]
-
-        for t in too_many_nulls_ids:
-            del id_types[t]
-
-        #    In theory, you could have an ID with a greater number of matches but a lower percentage.
-        # We opt to prefer an ID that is a tighter fit, even if it not as well represented in the roster
-        # since it is more likely to be the true source of studentUniqueId. In practice, it is highly
-        # unlikely that you would have, say, an 95% matching ID as well as a 92% matching one, but this
-        # is the theoretical basis
-        if len(id_types) == 0:
-            #    this can happen if the roster is particularly bare-bones; in that case we're banking on
-            # studentUniqueId being a match, but the below code will not work
-            # TODO: oh but could it be more efficient?
-            self.stu_unique_id_in_roster = None
-            return
-
-        highest_match_type = max(id_types, key=lambda outer_key: id_types[outer_key]['pct_matches'])
-        highest_match_rate = id_types[highest_match_type]["pct_matches"]
-
-        match_threshold = 0.95
-        if highest_match_rate >= match_threshold:
+        highest_match_type, highest_match_rate = stats.stu_unique_id_replica()
+        if highest_match_type:
             #    since we have a match between an "actual" ID type and studentUniqueId, we'll use
             # studentUniqueId for the crosswalk but keep the actual ID on hand for user-facing
             # messaging
@@ -793,13 +1510,11 @@ class JobExecutor:
         # If we ran Earthmover twice, we're only ever sending the first output set
         os.environ["DATA_DIR"] = self.output_sets[0].local_dir
         try:
-            lb = subprocess.run(
-                ["lightbeam", "-c", self.assessment_lightbeam, "send", "--results-file", artifact.LB_SEND_RESULTS.path]
+            # output is logged as lightbeam runs; lb.stderr keeps its tail for the error payload
+            lb = run_logged(
+                ["lightbeam", "-c", self.assessment_lightbeam, "send", "--results-file", artifact.LB_SEND_RESULTS.path],
+                self.logger, "lightbeam", running=self.running_procs,
             )
-            if lb.stdout:
-                self.logger.info(f"lightbeam stdout: {lb.stdout}")
-            if lb.stderr:
-                self.logger.info(f"lightbeam stderr: {lb.stderr}")
             lb.check_returncode()
 
         except subprocess.CalledProcessError:
@@ -839,48 +1554,79 @@ class JobExecutor:
             self.send_job_summary()
 
     def upload_output(self):
-        """Upload each Earthmover output set to S3 and notify the app of its location."""
+        """Upload every Earthmover output set to S3 in one parallel batch, notifying the app as each set fully lands."""
         self.set_action(action.UPLOAD_OUTPUT)
-        for set in self.output_sets:
-            self.upload_output_set(set)
-
-    def upload_output_set(self, output_set):
-        """Upload all non-empty JSONL files in one OutputSet's local_dir to its S3 subdir, then alert the app."""
-        s3_prefix = f"{self.s3_out_path}/{output_set.s3_subdir}"
-        uploaded = False
-        for fname in os.listdir(output_set.local_dir):
-            if not fname.endswith(".jsonl"):
-                continue
-            fpath = os.path.join(output_set.local_dir, fname)
-            if not os.path.isfile(fpath) or os.stat(fpath).st_size == 0:
-                continue
 
-            dest_fname = f"{s3_prefix}/{fname}"
-            self.logger.info(f"uploading output: {fname} -> {dest_fname}")
-            try:
-                self.s3.upload_file(fpath, self.app_bucket, dest_fname)
-            except botocore.exceptions.ClientError:
-                self.error = error.ArtifactS3UploadError(fname, dest_fname)
-                raise
-            uploaded = True
-
-        if not uploaded:
-            self.logger.warning(f"no Earthmover output files found in {output_set.local_dir} to upload")
-            return
+        uploads = []
+        remaining = {}
+        for i, output_set in enumerate(self.output_sets):
+            files = list_output_files(output_set.local_dir)
+            if not files:
+                self.logger.warning(f"no Earthmover output files found in {output_set.local_dir} to upload")
+                continue
+            remaining[i] = len(files)
+            s3_prefix = f"{self.s3_out_path}/{output_set.s3_subdir}"
+            for fname in files:
+                uploads.append((i, fname, os.path.join(output_set.local_dir, fname), f"{s3_prefix}/{fname}"))
+
+        with ThreadPoolExecutor(max_workers=config.S3_TRANSFER_MAX_WORKERS) as pool:
+            futures = {}
+            for i, fname, fpath, dest_fname in uploads:
+                self.logger.info(f"uploading output: {fname} -> {dest_fname}")
+                futures[pool.submit(self.upload_s3_file, fpath, self.app_bucket, dest_fname)] = (i, fname, dest_fname)
+
+            for future in as_completed(futures):
+                i, fname, dest_fname = futures[future]
+                try:
+                    num_bytes, _ = future.result()
+                except botocore.exceptions.ClientError:
+                    self.error = error.ArtifactS3UploadError(fname, dest_fname)
+                    pool.shutdown(cancel_futures=True)
+                    raise
+
+                self.timings.add_bytes(num_bytes)
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    output_set = self.output_sets[i]
+                    self.send_job_output_alert(f"{self.s3_out_path}/{output_set.s3_subdir}", output_set.sent_to_ods)
+
+    def upload_s3_file(self, fpath, bucket, key):
+        """Upload one local file to S3. Returns the number of bytes sent and the seconds it took"""
+        start = time.monotonic()
+        self.s3.upload_file(fpath, bucket, key, Config=self.s3_transfer_config)
+        return os.stat(fpath).st_size, time.monotonic() - start
 
-        self.send_job_output_alert(s3_prefix, output_set.sent_to_ods)
+    def upload_s3_file_compressed(self, fpath, bucket, key):
+        """Upload one local file to S3, compressing it on the way with the artifact compression encoding. Returns the number of bytes sent"""
+        start = time.monotonic()
+        with CompressingReader(fpath, self.artifact_compression) as reader:
+            self.s3.upload_fileobj(
+                reader, bucket, key,
+                ExtraArgs={"ContentEncoding": reader.encoding},
+                Config=self.s3_transfer_config,
+            )
+        self.logger.info(
+            f"uploaded {key} with {reader.encoding}: {reader.bytes_in} bytes -> {reader.bytes_out} bytes "
+            f"({reader.bytes_out / max(reader.bytes_in, 1):.1%}) in {time.monotonic() - start:.2f} seconds"
+        )
+        return reader.bytes_out
 
     def upload_remaining_artifacts(self):
         """Attempt to upload all artifacts that have not yet been uploaded"""
         self.logger.info("uploading remaining artifacts")
-        for a in artifact.ALL:
-            if a.needs_upload:
-                self.upload_artifact(a, fail_ok=True)
+        pending = [a for a in artifact.ALL if a.needs_upload]
+        with ThreadPoolExecutor(max_workers=config.S3_TRANSFER_MAX_WORKERS) as pool:
+            # list() surfaces any unexpected exception; expected S3 failures are swallowed by fail_ok
+            list(pool.map(lambda a: self.upload_artifact(a, fail_ok=True), pending))
 
     def upload_artifact(self, artifact_to_upload, fail_ok=False):
         """Upload one of the executor's artifacts to S3"""
         self.logger.debug(f"uploading artifact {artifact_to_upload.name}")
         fpath = artifact_to_upload.path
+        if self.s3_out_path is None:
+            # the job failed before unpack_job() said where its output goes
+            self.logger.debug("no output location for this job; not uploading")
+            return
 
         if not os.path.exists(fpath):
             if fail_ok:
@@ -896,9 +1642,12 @@ class JobExecutor:
             raise FileNotFoundError(fpath)
 
         try:
-            self.s3.upload_file(
-                fpath, self.app_bucket, f"{self.s3_out_path}/{os.path.basename(fpath)}"
-            )
+            key = f"{self.s3_out_path}/{os.path.basename(fpath)}"
+            if self.artifact_compression and artifact_to_upload.name in config.COMPRESSED_ARTIFACTS:
+                num_bytes = self.upload_s3_file_compressed(fpath, self.app_bucket, key)
+            else:
+                num_bytes, _ = self.upload_s3_file(fpath, self.app_bucket, key)
+            self.timings.add_bytes(num_bytes)
         except botocore.exceptions.ClientError:
             if fail_ok:
                 self.logger.debug(f"upload failed during shutdown. continuing...")
@@ -916,6 +1665,7 @@ class JobExecutor:
             self.update_success()
         self.action = next_action
         self.logger.info(f"beginning action: {next_action}")
+        self.timings.begin(next_action)
         self.update_begin()
 
     def update_begin(self):
@@ -924,63 +1674,148 @@ class JobExecutor:
 
     def update_success(self):
         """Send a message to the app indicating the success of an action"""
-        self.send_update(self.action, status.SUCCESS)
+        self.send_update(self.action, status.SUCCESS, self.timings.end(self.action, status.SUCCESS))
         # we do this so that we can change actions without necessarily logging success
         self.action = ""
 
-    def send_update(self, action, status):
-        """Send a message to the app indicating the beginning or conclusion of an action"""
+    def send_update(self, action, status, metrics=None, expected_status=None):
+        """Send a message to the app indicating the beginning or conclusion of an action, with its metrics if finished"""
         body = {"action": action, "status": status}
-        # return the response in case the caller wants to do something with it
-        return self.conn.post(self.status_url, json=body)
+        if metrics:
+            body["metrics"] = metrics
+        self.reporter.post(self.status_url, body, expected_status)
 
     def update_failure(self):
-        """Send a message to the app indicating the failure of an action and wait for a success response"""
-        attempt = 0
-        max_attempts = 3
-        while attempt < max_attempts:
-            attempt += 1
-            fail_resp = self.send_update(self.action, status.FAILURE)
-            if fail_resp.status_code != 201:
-                # Give the app a few chances to respond affirmatively. While there is no immediate risk
-                # of the executor's error payload arriving before this failure message, we want to
-                # establish that the failure message ought to arrive first and do our best to avoid a
-                # potential race condition
-                self.logger.debug(f"Failed to send final status update (attempt {attempt} of {max_attempts}): status {fail_resp.status_code}")
-                if attempt < max_attempts:
-                    time.sleep(attempt * 5)
-            else:
-                return
+        """Send a message to the app indicating the failure of an action, retried until the app acknowledges it"""
+        metrics = self.timings.end(self.action, status.FAILURE)
+        #    While there is no immediate risk of the executor's error payload arriving before this failure
+        # message, we want to establish that the failure message ought to arrive first. The reporter delivers
+        # in order and keeps retrying this until the app responds affirmatively, before it sends anything
+        # queued later
+        self.send_update(self.action, status.FAILURE, metrics, expected_status=201)
+
+    def write_timings(self):
+        """Write the job's per-action metrics to the timings artifact"""
+        with open(artifact.TIMINGS.path, "w") as f:
+            json.dump(self.timings.to_json(encoding_fallbacks=self.encoding_fallbacks), f, indent=2)
 
     def send_id_matches(self, id_name, id_type, count):
         self.logger.debug("Sending student ID match info")
         body = {"name": id_name, "type": id_type, "count": count}
-        self.conn.post(self.matches_url, json=body)
+        self.reporter.post(self.matches_url, body)
 
     def send_error(self):
         """Send a diagnostic message to app after a fatal error"""
         self.logger.debug("Sending error report")
-        self.conn.post(self.error_url, json=self.error.to_json())
+        self.reporter.post(self.error_url, self.error.to_json())
 
     def send_job_summary(self):
         """Send a user-facing message to app indicating what data was produced"""
         self.logger.debug(f"Sending summary")
-        self.conn.post(self.summary_url, json=self.summary)
+        self.reporter.post(self.summary_url, self.summary)
 
     def send_job_output_alert(self, s3_prefix, sent_to_ods):
         """Notify the app that an Earthmover output set has been uploaded to S3"""
         self.logger.debug(f"Notifying app of output set at {s3_prefix}")
-        self.conn.post(self.output_files_url, json={
+        self.reporter.post(self.output_files_url, {
             "sentToOds": sent_to_ods,
             "path": s3_prefix,
         })
 
 
+def make_app_session(headers=None):
+    """A requests session for calls to the app, retrying failed connections, with the given headers added"""
+    session = requests.Session()
+    retries = requests.adapters.Retry()
+    session.mount("http://", requests.adapters.HTTPAdapter(max_retries=retries))
+    session.mount("https://", requests.adapters.HTTPAdapter(max_retries=retries))
+    session.headers.update(headers or {})
+    return session
+
+
+def make_s3_client():
+    """An S3 client using the credentials currently in the environment"""
+    endpoint_url = os.environ.get("S3_ENDPOINT_URL")
+    # a new session: boto3's default one keeps the first credentials it resolved.
+    # boto3 clients are thread-safe, so one client is shared by every parallel transfer
+    return boto3.session.Session().client(
+        "s3",
+        config=botocore.config.Config(max_pool_connections=config.S3_TRANSFER_MAX_WORKERS * config.S3_MULTIPART_MAX_CONCURRENCY),
+        **({"endpoint_url": endpoint_url} if endpoint_url else {}),
+    )
+
+
+def claim_queued_job(queue_dir):
+    """Claim the oldest job file in queue_dir by renaming it. Returns the claimed path, or None if the queue is empty"""
+    queued = []
+    for name in os.listdir(queue_dir):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(queue_dir, name)
+        try:
+            queued.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            # claimed by another worker since the listing
+            continue
+    for _, path in sorted(queued):
+        claimed = f"{path}.{os.getpid()}.claimed"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            # another worker got there first
+            continue
+        return claimed
+    return None
+
+
+def git_head(repo_dir):
+    """The commit SHA currently checked out in repo_dir"""
+    return subprocess.run(
+        ["git", "-C", repo_dir, "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def prune_cache_entries(cache_dir, max_entries):
+    """Delete all but the max_entries most recently created entries (directories or files) in cache_dir"""
+    entries = sorted(
+        (os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if not name.endswith(".tmp")),
+        key=os.path.getmtime, reverse=True,
+    )
+    for path in entries[max_entries:]:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def encoding_cache_key(path):
+    """Key for a file's entry in JobExecutor.encoding_cache"""
+    # size and mtime as well, in case the file at this path is ever replaced
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
 def localize_s3_path(path):
     """Convert an S3 'path' to a single filename"""
     return path.replace("/", "__")
 
 
+def list_output_files(local_dir):
+    """Names of the non-empty JSONL files Earthmover wrote to local_dir"""
+    files = []
+    for fname in sorted(os.listdir(local_dir)):
+        if not fname.endswith(".jsonl"):
+            continue
+        fpath = os.path.join(local_dir, fname)
+        if not os.path.isfile(fpath) or os.stat(fpath).st_size == 0:
+            continue
+        files.append(fname)
+    return files
+
+
 def load_match_rates():
     """Read the latest Earthmover run's match_rates.csv. Returns an empty list when the file is missing or has no data rows."""
     try:
@@ -1001,21 +1836,128 @@ def count_unmatched_students():
     return int(rows[0]["num_rows"]) - int(rows[0]["num_matches"])
 
 
-def stream_to_file(session, url, dest_path, max_attempts=3):
-    """GET url as a stream and write the body to dest_path"""
-    for attempt in range(1, max_attempts + 1):
+class DownloadVerificationError(requests.exceptions.RequestException):
+    """A finished download doesn't match the length or digest the server declared for it"""
+
+
+class DownloadCancelled(Exception):
+    """A download was abandoned on request"""
+
+
+def stream_to_file(session, url, dest_path, max_attempts=None, tee=None, cancel=None):
+    """GET url as a stream and write the body to dest_path, feeding each chunk to tee if given
+
+    An interrupted transfer resumes from the bytes already written if the server honors a Range request,
+    and otherwise starts over. When the server declares the body's length or SHA-256 digest, the finished
+    file is checked against them. Returns the bytes written, the seconds it took, and the number of resumes.
+    Setting the cancel Event, if given, makes the download raise DownloadCancelled at its next chunk.
+    """
+    max_attempts = max_attempts or config.DOWNLOAD_MAX_ATTEMPTS
+    start = time.monotonic()
+    # bytes on disk that the next attempt can build on
+    written = 0
+    resumes = 0
+    attempt = 0
+    while True:
+        attempt += 1
+        # a resumed body must be unencoded so that its offsets line up with the decoded bytes on disk.
+        # A fresh one may be compressed in transit (requests asks for gzip by default)
+        headers = {"Range": f"bytes={written}-", "Accept-Encoding": "identity"} if written else {}
+        resumed = False
+        expected_size = None
+        corrupt = False
         try:
-            with session.get(url, stream=True) as resp:
+            with session.get(url, stream=True, headers=headers,
+                             timeout=(config.DOWNLOAD_CONNECT_TIMEOUT_SECONDS, config.DOWNLOAD_RESPONSE_TIMEOUT_SECONDS)) as resp:
+                # the app may take minutes to start responding, but once the body is flowing a quiet
+                # connection means the transfer has stalled
+                set_read_timeout(resp, config.DOWNLOAD_READ_TIMEOUT_SECONDS)
+                if resp.status_code == 416:
+                    # the range no longer makes sense, e.g. the body changed; start over
+                    raise DownloadVerificationError(f"server rejected a resume at byte {written}", response=resp)
                 resp.raise_for_status()
-                with open(dest_path, "wb") as f:
-                    for chunk in resp.iter_content(chunk_size=64 * 1024):
-                        if chunk:
-                            f.write(chunk)
-            return
+                resumed = written > 0 and resp.status_code == 206 and content_range(resp)[0] == written
+                if written and not resumed:
+                    print(f"stream_to_file: server did not resume at byte {written}; starting over")
+                resumes += resumed
+                expected_size, expected_sha256 = declared_size_and_digest(resp)
+                chunks = resp.iter_content(chunk_size=64 * 1024)
+                if cancel:
+                    # checked before the file is opened, too, so a cancelled download never truncates it
+                    if cancel.is_set():
+                        raise DownloadCancelled()
+                    chunks = until_cancelled(chunks, cancel)
+                write_stream(chunks, dest_path, tee, append=resumed)
+
+            size = os.stat(dest_path).st_size
+            if expected_size is not None and size != expected_size:
+                raise DownloadVerificationError(f"expected {expected_size} bytes but received {size}")
+            if expected_sha256 is not None and file_sha256(dest_path) != expected_sha256:
+                corrupt = True
+                raise DownloadVerificationError("downloaded body does not match the digest the server declared")
+            return size, time.monotonic() - start, resumes
+
         except (requests.exceptions.ChunkedEncodingError,
-                requests.exceptions.ConnectionError) as e:
-            if attempt == max_attempts:
+                requests.exceptions.ConnectionError,
+                DownloadVerificationError) as e:
+            kept = os.stat(dest_path).st_size if os.path.exists(dest_path) and not corrupt else 0
+            if (e.response is not None and e.response.status_code == 416) or (expected_size is not None and kept > expected_size):
+                kept = 0
+            # a resumed attempt that got further doesn't count against the limit; any other failure does
+            if resumed and kept > written:
+                attempt -= 1
+            written = kept
+            if attempt >= max_attempts:
                 raise
-            sleep_seconds = attempt * 5
-            print(f"stream_to_file: attempt {attempt}/{max_attempts} failed ({type(e).__name__}); retrying in {sleep_seconds}s")
-            time.sleep(sleep_seconds)
+            backoff = random.uniform(0, min(config.DOWNLOAD_BACKOFF_MAX_SECONDS, config.DOWNLOAD_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+            print(f"stream_to_file: attempt {attempt}/{max_attempts} failed ({type(e).__name__}: {e}) with {written} bytes kept; retrying in {backoff:.1f}s")
+            time.sleep(backoff)
+
+
+def set_read_timeout(resp, seconds):
+    """Limit how long each read of a streamed response's body may wait for data"""
+    sock = getattr(getattr(resp.raw, "connection", None), "sock", None)
+    if sock is not None:
+        sock.settimeout(seconds)
+
+
+def until_cancelled(chunks, cancel):
+    """Pass chunks through until cancel is set, then raise DownloadCancelled"""
+    for chunk in chunks:
+        if cancel.is_set():
+            raise DownloadCancelled()
+        yield chunk
+
+
+def content_range(resp):
+    """The first byte and total size from a 206 response's Content-Range, as (start, total); either may be None"""
+    match = re.fullmatch(r"bytes (\d+)-\d+/(\d+|\*)", resp.headers.get("Content-Range", "").strip())
+    if not match:
+        return None, None
+    return int(match.group(1)), None if match.group(2) == "*" else int(match.group(2))
+
+
+def declared_size_and_digest(resp):
+    """The complete body's size and hex SHA-256 as declared by the response, each None if not declared
+
+    Both describe the unencoded body, so neither is known for a compressed response
+    """
+    if resp.headers.get("Content-Encoding", "identity").lower() != "identity":
+        return None, None
+
+    if resp.status_code == 206:
+        size = content_range(resp)[1]
+    else:
+        size = int(resp.headers["Content-Length"]) if resp.headers.get("Content-Length", "").isdigit() else None
+
+    # RFC 9530 Repr-Digest (sha-256=:<base64>:) or the older RFC 3230 Digest (SHA-256=<base64>)
+    digest = None
+    for header in ["Repr-Digest", "Digest"]:
+        for item in resp.headers.get(header, "").split(","):
+            algorithm, _, value = item.strip().partition("=")
+            if algorithm.lower() == "sha-256" and value:
+                try:
+                    digest = base64.b64decode(value.strip(":")).hex()
+                except ValueError:
+                    pass
+    return size, digest
@@ -0,0 +1,135 @@
+# Input encoding helpers work out how the user's assessment file should be decoded.
+#
+# Assessment files can be very large, so detection looks at a bounded sample of the file rather than
+# the whole thing: byte-order marks are trusted outright, and otherwise chardet is fed slices taken
+# from the head, middle, and tail of the file.
+#
+# A guess can still be wrong, and Earthmover only finds out after transforming the file. So before
+# Earthmover starts, the chosen encoding is checked by actually decoding the file, falling back to
+# other candidates if it doesn't decode.
+#
+# An input that needs a non-default encoding is then transcoded to UTF-8 once, so that everything after
+# that reads it without being told how.
+
+import codecs
+import mmap
+import os
+import shutil
+import time
+
+from chardet.universaldetector import UniversalDetector
+
+# checked longest-first, since the UTF-32 LE mark begins with the UTF-16 LE mark.
+# Names match what chardet reports for the same files
+BOMS = [
+    (codecs.BOM_UTF32_LE, "UTF-32"),
+    (codecs.BOM_UTF32_BE, "UTF-32"),
+    (codecs.BOM_UTF8, "UTF-8-SIG"),
+    (codecs.BOM_UTF16_LE, "UTF-16"),
+    (codecs.BOM_UTF16_BE, "UTF-16"),
+]
+FEED_BYTES = 64 * 1024
+
+
+class EncodingGuess:
+    def __init__(self, encoding, bytes_examined, seconds, method, timed_out=False):
+        # Encoding name as reported by chardet, or None if it could not tell
+        self.encoding = encoding
+        # How much of the file was actually looked at
+        self.bytes_examined = bytes_examined
+        self.seconds = seconds
+        # "bom", "sample", or "full"
+        self.method = method
+        # Whether detection gave up before examining everything it meant to
+        self.timed_out = timed_out
+
+
+def detect_encoding(path, sample_bytes=None, max_seconds=None):
+    """Guess the encoding of the file at path
+
+    With sample_bytes, at most that many bytes are examined, split between the head, middle, and tail of
+    the file. Without it, the whole file is examined. Detection stops early after max_seconds.
+    """
+    start = time.monotonic()
+    size = os.stat(path).st_size
+    with open(path, "rb") as f:
+        head = f.read(4)
+        for bom, encoding in BOMS:
+            if head.startswith(bom):
+                return EncodingGuess(encoding, len(bom), time.monotonic() - start, "bom")
+
+        if sample_bytes is None or size <= sample_bytes:
+            # same as chardet's default usage: stream the file until the detector is confident
+            method = "full"
+            slices = [(0, size)]
+            detector = UniversalDetector()
+        else:
+            method = "sample"
+            third = sample_bytes // 3
+            slices = [(0, third), ((size - third) // 2, third), (size - third, third)]
+            # chardet otherwise stops reading after its own default budget, which the head alone would exhaust
+            detector = UniversalDetector(max_bytes=sample_bytes)
+
+        examined = 0
+        timed_out = False
+        for offset, length in slices:
+            f.seek(offset)
+            if offset > 0:
+                # start at a line boundary so a multi-byte character is never cut in half
+                length -= len(f.readline())
+            while length > 0 and not detector.done and not timed_out:
+                chunk = f.read(min(FEED_BYTES, length))
+                if not chunk:
+                    break
+                detector.feed(chunk)
+                examined += len(chunk)
+                length -= len(chunk)
+                timed_out = max_seconds is not None and time.monotonic() - start > max_seconds
+
+    result = detector.close()
+    return EncodingGuess(result["encoding"], examined, time.monotonic() - start, method, timed_out)
+
+
+def first_decodable(path, encodings, chunk_bytes=16 * 1024 * 1024):
+    """The first of encodings that can decode the entire file at path, or None if none can
+
+    The file is memory-mapped and decoded chunk by chunk, so this is cheap in memory even for very large
+    files. Pure-ASCII chunks are skipped for ASCII-compatible encodings since they always decode.
+    """
+    size = os.stat(path).st_size
+    if size == 0:
+        return encodings[0] if encodings else None
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for encoding in encodings:
+            if decodes(mm, size, encoding, chunk_bytes):
+                return encoding
+    return None
+
+
+def decodes(mm, size, encoding, chunk_bytes):
+    """Whether the mapped bytes decode cleanly with encoding"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+    ascii_compatible = "a".encode(encoding) == b"a"
+    try:
+        for offset in range(0, size, chunk_bytes):
+            chunk = mm[offset:offset + chunk_bytes]
+            final = offset + chunk_bytes >= size
+            # only safe to skip when no partial character is carried over from the previous chunk
+            if ascii_compatible and chunk.isascii() and not decoder.getstate()[0]:
+                continue
+            decoder.decode(chunk, final=final)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def transcode_to_utf8(src_path, dest_path, encoding, chunk_chars=4 * 1024 * 1024):
+    """Rewrite a file in UTF-8, decoding it with encoding. Line endings are kept, and a byte-order mark is dropped
+
+    Raises UnicodeDecodeError, leaving dest_path incomplete, if the file doesn't decode
+    """
+    # newline="" on both sides keeps line endings exactly as they are in the file
+    with open(src_path, encoding=encoding, errors="strict", newline="") as src, \
+            open(dest_path, "w", encoding="utf-8", newline="") as dest:
+        shutil.copyfileobj(src, dest, chunk_chars)
@@ -0,0 +1,182 @@
+# The match probe estimates how well an input file's student IDs will match a roster, before Earthmover
+# transforms the whole file to find out.
+#
+# A sample of input rows, spread across the file, is read, and the values of its candidate ID columns are
+# treated as potential student IDs. Candidates are the wrapper's POSSIBLE_STUDENT_ID_COLUMNS when the input
+# has them, and otherwise the columns whose values mostly look like IDs: single tokens, unlike e.g. names
+# with spaces. The roster is then streamed once, collecting which of those values it holds for each ID
+# type (studentUniqueId included). Only roster lines that contain one of the sampled values as a token are
+# parsed, so the pass is fast even for large rosters and memory stays proportional to the sample rather
+# than the roster.
+#
+# Values are compared as exact strings, not with the wrapper's own ID matching, so the estimate can be off
+# by however much the two differ; callers should only act on it when it is far from their threshold.
+#
+# Columns are considered by position, not by name, so a file whose header is not on its first line is
+# still judged by its data.
+
+import csv
+import os
+import re
+
+from executor.roster import json_loads
+
+# runs of characters that JSON keys, strings, and numbers in a roster line can be split into
+TOKEN = re.compile(rb'[^\s"{}\[\],:]+')
+
+
+class MatchEstimate:
+    def __init__(self, column, id_type, match_rate, sample_rows):
+        # Name (from the first row) of the input column that matched best
+        self.column = column
+        # Roster ID type it matched, e.g. "State" or "studentUniqueId"
+        self.id_type = id_type
+        # Fraction of sampled rows whose value in that column is in the roster as that ID type
+        self.match_rate = match_rate
+        self.sample_rows = sample_rows
+
+
+def sample_input(path, encoding, max_rows, num_slices=1):
+    """The first row of a delimited input file and up to max_rows of the non-blank rows after it
+
+    Rows are taken from num_slices evenly spaced places in the file, since files are often sorted (e.g.
+    by school), and a sample from the head alone may not represent the rest.
+    """
+    with open(path, newline="", encoding=encoding, errors="replace") as f:
+        head = f.read(64 * 1024)
+    try:
+        dialect = csv.Sniffer().sniff(head, delimiters=",\t|;")
+    except csv.Error:
+        dialect = csv.excel
+
+    if "a".encode(encoding) != b"a":
+        # byte offsets can't be resynchronized on a line in e.g. UTF-16, so only the head is sampled
+        with open(path, newline="", encoding=encoding, errors="replace") as f:
+            reader = csv.reader(f, dialect)
+            header = next(reader, [])
+            return header, take_rows(reader, max_rows)
+
+    header = None
+    rows = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        for i in range(num_slices):
+            offset = i * size // num_slices
+            resynced = False
+            # if the previous slice already read past this one's start, this one carries on from there
+            if i and offset > f.tell():
+                f.seek(offset)
+                # resume at the next line boundary
+                f.readline()
+                resynced = True
+            reader = csv.reader(decoded_lines(f, encoding), dialect)
+            if header is None:
+                header = next(reader, [])
+            # a slice can begin inside a quoted value that spans lines; rows misread from it won't have the
+            # header's shape
+            expected_columns = len(header) if resynced and header else None
+            # rows a slice couldn't supply go to the slices after it
+            quota = (max_rows - len(rows)) // (num_slices - i)
+            rows.extend(take_rows(reader, quota, expected_columns))
+    return header or [], rows
+
+
+def decoded_lines(f, encoding):
+    for line in iter(f.readline, b""):
+        yield line.decode(encoding, errors="replace")
+
+
+def take_rows(reader, max_rows, expected_columns=None):
+    """Up to max_rows non-blank rows from a csv reader, optionally only those with expected_columns values"""
+    rows = []
+    if max_rows <= 0:
+        return rows
+    for row in reader:
+        # blank lines, e.g. from \r\r\n line endings, are skipped by Earthmover too
+        if not any(value.strip() for value in row):
+            continue
+        if expected_columns is not None and len(row) != expected_columns:
+            continue
+        rows.append([value.strip() for value in row])
+        # stop without reading another row, so that the file position stays at the end of this slice
+        if len(rows) >= max_rows:
+            break
+    return rows
+
+
+def is_plain_token(value):
+    """Whether a value would appear in a roster line as a single token, so the token prefilter can find it"""
+    return value.isascii() and TOKEN.fullmatch(value.encode()) is not None
+
+
+def candidate_columns(header, rows, id_columns=None):
+    """Positions of the columns whose values may be student IDs
+
+    The named id_columns that the header has, if any; otherwise every column at least half of whose sampled
+    values are plain tokens
+    """
+    if id_columns:
+        named = [header.index(c) for c in id_columns if c in header]
+        if named:
+            return named
+    columns = []
+    for i in range(max(len(row) for row in rows)):
+        values = [row[i] for row in rows if i < len(row) and row[i]]
+        if values and 2 * sum(1 for v in values if is_plain_token(v)) >= len(values):
+            columns.append(i)
+    return columns
+
+
+def roster_hits(roster_path, values):
+    """The (ID type, value) pairs in the roster whose value is one of values"""
+    encoded = {v.encode() for v in values}
+    # the token check can only rule out a line if every value would appear in it as a single plain token
+    use_prefilter = all(is_plain_token(v) for v in values)
+
+    hits = set()
+    with open(roster_path, "rb") as f:
+        for line in f:
+            if use_prefilter and encoded.isdisjoint(TOKEN.findall(line)):
+                continue
+            if not line.strip():
+                continue
+            record = json_loads(line)
+            try:
+                unique_id = str(record["studentReference"]["studentUniqueId"])
+                if unique_id in values:
+                    hits.add(("studentUniqueId", unique_id))
+                for id_code in record.get("studentIdentificationCodes", []):
+                    code = str(id_code["identificationCode"])
+                    if code in values:
+                        hits.add((id_code["studentIdentificationSystemDescriptor"].split("#")[-1], code))
+            except KeyError:
+                # malformed records can't match anything, same as in RosterIdStats
+                continue
+    return hits
+
+
+def estimate_match_rate(roster_path, input_path, encoding, sample_rows, id_columns=None, num_slices=1):
+    """Estimate the best column/ID type match rate between an input file and a roster
+
+    id_columns optionally names the columns that may hold IDs (see candidate_columns()). The sample is drawn
+    from num_slices places in the input. Returns None if the sample holds no rows.
+    """
+    header, rows = sample_input(input_path, encoding, sample_rows, num_slices)
+    if not rows:
+        return None
+
+    columns = candidate_columns(header, rows, id_columns)
+    # only plain tokens are looked up, so that the roster pass keeps its prefilter
+    values = {row[i] for row in rows for i in columns if i < len(row) and row[i] and is_plain_token(row[i])}
+    hits = roster_hits(roster_path, values)
+    # on ties, prefer studentUniqueId, which is what the crosswalk uses when it replicates another ID type
+    id_types = sorted({id_type for id_type, _ in hits}, key=lambda t: (t != "studentUniqueId", t))
+
+    best = MatchEstimate(None, None, 0.0, len(rows))
+    for i in columns:
+        for id_type in id_types:
+            matches = sum(1 for row in rows if i < len(row) and (id_type, row[i]) in hits)
+            if matches / len(rows) > best.match_rate:
+                name = header[i] if i < len(header) else f"column {i + 1}"
+                best = MatchEstimate(name, id_type, matches / len(rows), len(rows))
+    return best
@@ -0,0 +1,92 @@
+# Process output is logged as it is produced rather than collected and logged once a command exits.
+#
+# Earthmover and lightbeam can print hundreds of megabytes on large or verbose runs. Holding all of that
+# in memory only to log it afterwards is wasteful, and it hides progress while the command is running.
+# Instead each line is handed to the logger the moment it arrives, and only the last few lines are kept:
+# enough for error payloads and for recognizing specific failures, like a decoding error.
+
+import collections
+import subprocess
+import threading
+
+import executor.config as config
+
+
+class OutputTail:
+    """A writable text stream that passes each complete line to on_line and remembers only the last max_lines"""
+    def __init__(self, on_line=None, max_lines=None):
+        self.on_line = on_line
+        self.lines = collections.deque(maxlen=max_lines or config.PROCESS_OUTPUT_TAIL_LINES)
+        self._partial = ""
+
+    def write(self, text):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._add(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Count whatever is left over once the stream has ended"""
+        if self._partial:
+            self._add(self._partial)
+            self._partial = ""
+
+    def getvalue(self):
+        """The remembered tail of the output"""
+        return "".join(f"{line}\n" for line in self.lines)
+
+    def _add(self, line):
+        if self.on_line:
+            self.on_line(line)
+        # a runaway line shouldn't defeat the bound on how much is remembered
+        self.lines.append(line[:config.PROCESS_OUTPUT_MAX_LINE_CHARS])
+
+
+def run_logged(args, logger, name, check=False, env=None, running=None):
+    """Run a command, logging its stdout and stderr line by line as they are produced
+
+    env replaces the environment the command runs in. While the command runs, its Popen is in the set
+    running, if one is given, so that another thread can kill it.
+    Returns a subprocess.CompletedProcess whose stdout and stderr are only the tail of each stream
+    """
+    tails = {
+        "stdout": OutputTail(lambda line: logger.info(f"{name} stdout: {line}")),
+        "stderr": OutputTail(lambda line: logger.info(f"{name} stderr: {line}")),
+    }
+    # undecodable output is replaced rather than allowed to kill a reader
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace", env=env)
+    if running is not None:
+        running.add(proc)
+
+    def read(stream, tail):
+        for line in stream:
+            tail.write(line)
+        tail.close()
+
+    # both pipes are drained at once, so the process never blocks on a full one
+    readers = [
+        threading.Thread(target=read, args=(proc.stdout, tails["stdout"]), daemon=True),
+        threading.Thread(target=read, args=(proc.stderr, tails["stderr"]), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    try:
+        returncode = proc.wait()
+        for reader in readers:
+            reader.join()
+    except BaseException:
+        # e.g. the job timed out; don't leave the command running behind us
+        proc.kill()
+        raise
+    finally:
+        if running is not None:
+            running.discard(proc)
+
+    completed = subprocess.CompletedProcess(args, returncode, tails["stdout"].getvalue(), tails["stderr"].getvalue())
+    if check:
+        completed.check_returncode()
+    return completed
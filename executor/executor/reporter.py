@@ -0,0 +1,94 @@
+# The reporter delivers the executor's callbacks to the app without holding up the job.
+#
+# Status updates, ID match counts, summaries, output alerts, and error payloads are queued and POSTed by a
+# background thread, which retries with jittered exponential backoff when the app is slow or briefly
+# unavailable. There is one queue and one thread, so callbacks always arrive in the order they were
+# queued: in particular, a failure status is delivered (or given up on) before the error payload queued
+# after it is sent. Each job has its own reporter, closed as the job finishes so that its thread exits.
+
+import queue
+import random
+import threading
+import time
+
+import requests
+
+import executor.config as config
+
+
+class Reporter:
+    def __init__(self, session, logger):
+        self.session = session
+        self.logger = logger
+        self._queue = queue.Queue()
+        # number of callbacks queued but not yet delivered or given up on
+        self._pending = 0
+        self._idle = threading.Condition()
+        # a daemon so that callbacks to an unresponsive app can never keep the process alive
+        self._thread = threading.Thread(target=self._deliver_all, daemon=True, name="reporter")
+        self._thread.start()
+
+    def post(self, url, body, expected_status=None):
+        """Queue a JSON POST to url. It counts as delivered on expected_status, or on any 2xx status if none is given
+
+        A job that failed before learning its callback URLs passes None, and nothing is sent
+        """
+        if url is None:
+            self.logger.debug("no callback URL; not sending")
+            return
+        with self._idle:
+            self._pending += 1
+        self._queue.put((url, body, expected_status))
+
+    def flush(self, timeout):
+        """Wait up to timeout seconds for everything queued so far to be delivered. Returns whether it was
+
+        With no timeout, waits for as long as the callbacks' own retries take
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                if deadline is None:
+                    self._idle.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def close(self):
+        """Let the background thread exit once it has dealt with everything queued so far; nothing may be posted after"""
+        self._queue.put(None)
+
+    def _deliver_all(self):
+        while True:
+            callback = self._queue.get()
+            if callback is None:
+                return
+            url, body, expected_status = callback
+            try:
+                self._deliver(url, body, expected_status)
+            except Exception:
+                self.logger.error(f"unexpected error delivering callback to {url}", exc_info=True)
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def _deliver(self, url, body, expected_status):
+        max_attempts = config.REPORTER_MAX_ATTEMPTS
+        for attempt in range(1, max_attempts + 1):
+            try:
+                resp = self.session.post(url, json=body, timeout=config.REPORTER_REQUEST_TIMEOUT_SECONDS)
+                if resp.status_code == expected_status if expected_status else resp.ok:
+                    return
+                problem = f"status {resp.status_code}"
+            except requests.exceptions.RequestException as e:
+                problem = repr(e)
+
+            self.logger.debug(f"callback to {url} failed (attempt {attempt} of {max_attempts}): {problem}")
+            if attempt < max_attempts:
+                # full jitter, so that many executors retrying against a struggling app spread out
+                backoff = min(config.REPORTER_BACKOFF_MAX_SECONDS, config.REPORTER_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+                time.sleep(random.uniform(0, backoff))
+        self.logger.error(f"giving up on callback to {url} after {max_attempts} attempts")
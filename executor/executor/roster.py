@@ -0,0 +1,130 @@
+# Roster ID statistics describe which student ID types appear in an Ed-Fi roster and how well each of
+# them lines up with studentUniqueId.
+#
+# Rosters can contain millions of enrollments, so the statistics are accumulated one record at a time
+# and never require the roster to be held in memory. They can also be fed raw bytes while a roster is
+# being downloaded, so the file never has to be read back just to compute them.
+
+try:
+    # optional: orjson parses roster lines several times faster than the standard library
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+class RosterIdStats:
+    # an ID type must be populated on at least this fraction of roster records to be considered
+    NOT_NULL_THRESHOLD = 0.5
+    # fraction of an ID type's non-null values that must equal studentUniqueId to call it a replica
+    MATCH_THRESHOLD = 0.95
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget everything counted so far, e.g. because a download restarted from the beginning"""
+        self.num_records = 0
+        # per ID type: how many records have a value, and how many of those values equal studentUniqueId
+        self.id_types = {}
+        # trailing bytes of a line split across chunks passed to feed()
+        self._partial = b""
+
+    def feed(self, chunk):
+        """Count every complete line in a chunk of roster bytes, holding any incomplete final line for the next chunk"""
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.add_line(line)
+
+    def close(self):
+        """Count whatever is left over from feed() once the roster is complete"""
+        self.add_line(self._partial)
+        self._partial = b""
+
+    def add_line(self, line):
+        """Count one line of roster JSONL (str or bytes). Blank lines are ignored"""
+        line = line.strip()
+        if not line:
+            return
+        self.add_record(json_loads(line))
+
+    def add_record(self, record):
+        """Count one stu-ed-org record"""
+        self.num_records += 1
+        try:
+            for id_code in record["studentIdentificationCodes"]:
+                # a given roster record may have several ID descriptors with different values
+                # using split()[-1] here because it's possible for these ID types to have a full descriptor URI, and also for them to be bare
+                id_type = id_code["studentIdentificationSystemDescriptor"].split("#")[-1]
+                if id_type not in self.id_types:
+                    self.id_types[id_type] = {
+                        "stu_id_matches": 0,
+                        "non_nulls": 0
+                    }
+                if str(id_code["identificationCode"]) == str(record["studentReference"]["studentUniqueId"]):
+                    self.id_types[id_type]["stu_id_matches"] += 1
+                if id_code["identificationCode"]:
+                    self.id_types[id_type]["non_nulls"] += 1
+        except KeyError:
+            # any malformed or incomplete stu-ed-org record doesn't need to be counted for this
+            pass
+
+    def distinct_id_types(self):
+        """All types of IDs represented in the roster"""
+        return set(self.id_types.keys())
+
+    def stu_unique_id_replica(self):
+        """The ID type whose values replicate studentUniqueId, and its match rate
+
+        Returns (None, None) when no sufficiently populated ID type matches closely enough
+        """
+        pct_matches = {}
+        for t, counts in self.id_types.items():
+            # what fraction of all the records have this ID?
+            if counts["non_nulls"] / self.num_records < self.NOT_NULL_THRESHOLD:
+                continue
+            # of the records that have this ID, what fraction of the ID's values match
+            pct_matches[t] = counts["stu_id_matches"] / counts["non_nulls"]
+
+        #    In theory, you could have an ID with a greater number of matches but a lower percentage.
+        # We opt to prefer an ID that is a tighter fit, even if it not as well represented in the roster
+        # since it is more likely to be the true source of studentUniqueId. In practice, it is highly
+        # unlikely that you would have, say, an 95% matching ID as well as a 92% matching one, but this
+        # is the theoretical basis
+        if len(pct_matches) == 0:
+            #    this can happen if the roster is particularly bare-bones; in that case we're banking on
+            # studentUniqueId being a match
+            return None, None
+
+        highest_match_type = max(pct_matches, key=pct_matches.get)
+        highest_match_rate = pct_matches[highest_match_type]
+        if highest_match_rate < self.MATCH_THRESHOLD:
+            return None, None
+        return highest_match_type, highest_match_rate
+
+
+def scan_roster_file(path):
+    """Accumulate RosterIdStats over a roster JSONL file in a single streaming pass"""
+    stats = RosterIdStats()
+    with open(path, "rb") as f:
+        for line in f:
+            stats.add_line(line)
+    return stats
+
+
+def write_stream(chunks, dest_path, tee=None, append=False):
+    """Write an iterable of byte chunks to dest_path, passing each chunk to tee.feed() along the way
+
+    With append, the chunks continue an interrupted earlier write: they are added to the end of the file
+    and tee carries on from where it left off
+    """
+    if tee and not append:
+        tee.reset()
+    with open(dest_path, "ab" if append else "wb") as f:
+        for chunk in chunks:
+            if chunk:
+                f.write(chunk)
+                if tee:
+                    tee.feed(chunk)
+    if tee:
+        tee.close()
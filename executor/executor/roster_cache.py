@@ -0,0 +1,89 @@
+# The roster cache keeps recently fetched ODS rosters on local disk so that back-to-back jobs against
+# the same ODS don't each repeat a full lightbeam fetch.
+#
+# Entries are keyed by the ODS URL, the API client (different credentials can see different
+# enrollments), and the school year. Each entry records when it was fetched along with the roster's
+# size and SHA-256, and is only reused while it is younger than the TTL and still matches both. An entry
+# is invalidated as soon as a job using it finds input rows it can't match, since the user is then likely
+# to fix the ODS and rerun.
+#
+# Rosters are never modified once written, so an entry is hard-linked into place when possible rather
+# than copied.
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+
+class RosterCache:
+    def __init__(self, cache_dir, ttl_seconds):
+        self.cache_dir = cache_dir
+        # 0 disables the cache
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0
+
+    def key(self, ods_url, client_id, api_year):
+        """Cache key for the roster visible to one API client in one year of an ODS"""
+        return hashlib.sha256(f"{ods_url.rstrip('/')}\n{client_id}\n{api_year}".encode()).hexdigest()
+
+    def lookup(self, key):
+        """Path of the cached roster for key if it is fresh and intact, otherwise None"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, "meta.json")) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        path = os.path.join(entry_dir, "roster.jsonl")
+        if time.time() - meta["fetched_at"] > self.ttl_seconds:
+            return None
+        if not os.path.isfile(path) or os.stat(path).st_size != meta["size"]:
+            return None
+        if file_sha256(path) != meta["sha256"]:
+            return None
+        return path
+
+    def store(self, key, roster_path):
+        """Cache a freshly fetched roster under key"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_dir = os.path.join(self.cache_dir, key)
+        # build under a temporary name so an interrupted write is never mistaken for an entry
+        tmp_dir = f"{entry_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.mkdir(tmp_dir)
+        link_or_copy(roster_path, os.path.join(tmp_dir, "roster.jsonl"))
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump({
+                "fetched_at": time.time(),
+                "size": os.stat(roster_path).st_size,
+                "sha256": file_sha256(roster_path),
+            }, f)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.rename(tmp_dir, entry_dir)
+
+
+    def invalidate(self, key):
+        """Drop the cached roster for key, so the next job against the same ODS fetches it afresh"""
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dest):
+    """Hard-link src to dest, falling back to a copy across filesystems"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
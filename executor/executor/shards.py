@@ -0,0 +1,248 @@
+# Sharded Earthmover runs split a large delimited input into row ranges that are transformed concurrently,
+# then merge the shards' output back into what one run over the whole input would have written.
+#
+# Shards are only cut between records, counting quotes so that a quoted value spanning several lines is
+# never split, and each shard repeats the input's first record as its header. That is only right when the
+# input source reads exactly one header row, Earthmover's default, so inputs whose source configures its
+# header differently (or whose configuration can't be read) are never sharded. Every shard's Earthmover
+# loads the whole roster, so the number of shards is also capped by the memory available. Merging:
+#   - output JSONL is concatenated in shard order. Student records are kept as they are; any other record
+#     (like assessment metadata, which every shard produces) is kept only the first time it appears
+#   - match rates are re-totalled per input column and ID type, over the rows of every shard
+#   - unmatched students are concatenated, keeping only the first shard's header
+#   - in the Earthmover results, destination row counts are recounted from the merged JSONL, the counts
+#     of the input source and of transformations are summed, and other sources (seeds, which every shard
+#     reads whole) are taken from the first shard
+
+import csv
+import json
+import os
+import shutil
+
+import yaml
+
+import executor.artifacts as artifact
+
+INPUT_SOURCE = "$sources.input"
+INPUT_SOURCE_NAME = "input"
+DEST_PREFIX = "$destinations."
+
+
+class Shard:
+    def __init__(self, shard_dir, index, extension):
+        self.index = index
+        self.dir = os.path.join(shard_dir, str(index))
+        self.input_path = os.path.join(self.dir, f"input{extension}")
+        self.output_dir = os.path.join(self.dir, "output")
+        self.results_path = os.path.join(self.dir, "em-results.json")
+        # data records (not counting the header) in this shard's input
+        self.rows = 0
+        os.makedirs(self.output_dir)
+
+    def output_path(self, name):
+        return os.path.join(self.output_dir, name)
+
+
+def records(f):
+    """The CSV records in a text file, each made of as many lines as its quoted values span"""
+    record = ""
+    for line in f:
+        record += line
+        # doubled quotes inside a quoted value leave the count even, so only an open quote makes it odd
+        if record.count('"') % 2 == 0:
+            yield record
+            record = ""
+    if record:
+        yield record
+
+
+def input_header_rows(yaml_paths):
+    """The number of header rows the input source reads, per the given Earthmover project files
+
+    Files are given in order of precedence (the wrapper before the assessment bundle it overrides), and a
+    source that doesn't set header_rows reads one. Returns None if a file can't be read as plain YAML (e.g.
+    it is Jinja-templated), or if header_rows is templated or the source names its own columns
+    """
+    header_rows = 1
+    for yaml_path in reversed(yaml_paths):
+        if not os.path.exists(yaml_path):
+            continue
+        try:
+            with open(yaml_path) as f:
+                project = yaml.safe_load(f) or {}
+        except (yaml.YAMLError, UnicodeError):
+            return None
+        sources = project.get("sources") if isinstance(project, dict) else None
+        source = (sources or {}).get(INPUT_SOURCE_NAME) if isinstance(sources, dict) else None
+        if not isinstance(source, dict):
+            continue
+        if "columns" in source:
+            return None
+        if "header_rows" in source:
+            header_rows = source["header_rows"]
+    return header_rows if isinstance(header_rows, int) else None
+
+
+def available_memory():
+    """Bytes of memory available to new processes, or None where that can't be told"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def split_input(path, encoding, num_shards, shard_dir):
+    """Split a delimited file into up to num_shards shards of about equal size, each headed by the file's first record
+
+    Shards are written in the file's own encoding. Returns the shards, in input order
+    """
+    extension = os.path.splitext(path)[1]
+    target_size = os.stat(path).st_size / num_shards
+    shards = []
+    shard = out = None
+    with open(path, newline="", encoding=encoding) as f:
+        reader = records(f)
+        header = next(reader, "")
+        try:
+            for record in reader:
+                if out is None:
+                    shard = Shard(shard_dir, len(shards), extension)
+                    shards.append(shard)
+                    out = open(shard.input_path, "w", newline="", encoding=encoding)
+                    out.write(header)
+                    shard_size = 0
+                out.write(record)
+                shard.rows += 1
+                shard_size += len(record)
+                if shard_size >= target_size and len(shards) < num_shards:
+                    out.close()
+                    out = None
+        finally:
+            if out is not None:
+                out.close()
+    return shards
+
+
+def load_match_rates(path):
+    try:
+        with open(path) as f:
+            return list(csv.DictReader(f, skipinitialspace=True))
+    except FileNotFoundError:
+        return []
+
+
+def winning_match(shard):
+    """The (input column, ID type) that matched best in a shard, or None if nothing matched"""
+    rows = load_match_rates(shard.output_path(os.path.basename(artifact.MATCH_RATES.path)))
+    if not rows:
+        return None
+    best = max(rows, key=lambda mr: float(mr["match_rate"]))
+    return best["source_column_name"], best["edfi_column_name"]
+
+
+def merge_shards(shards, output_dir, results_path):
+    """Merge the output and results of completed shards into output_dir and results_path"""
+    os.makedirs(output_dir, exist_ok=True)
+    names = sorted(set().union(*(os.listdir(shard.output_dir) for shard in shards)))
+    for name in names:
+        paths = [shard.output_path(name) for shard in shards if os.path.isfile(shard.output_path(name))]
+        dest_path = os.path.join(output_dir, name)
+        if name.endswith(".jsonl"):
+            merge_jsonl(paths, dest_path)
+        elif name == os.path.basename(artifact.MATCH_RATES.path):
+            merge_match_rates(shards, dest_path)
+        elif name == os.path.basename(artifact.UNMATCHED_STUDENTS.path):
+            merge_unmatched(paths, dest_path)
+        else:
+            shutil.copyfile(paths[0], dest_path)
+    merge_results(shards, results_path, output_dir)
+
+
+def merge_jsonl(paths, dest_path):
+    seen = set()
+    with open(dest_path, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    if b'"studentReference"' not in line:
+                        if line in seen:
+                            continue
+                        seen.add(line)
+                    out.write(line if line.endswith(b"\n") else line + b"\n")
+
+
+def merge_match_rates(shards, dest_path):
+    total_rows = 0
+    # per (input column, ID type): a representative row and the total number of matches
+    merged = {}
+    fieldnames = None
+    for shard in shards:
+        rows = load_match_rates(shard.output_path(os.path.basename(artifact.MATCH_RATES.path)))
+        # a shard with no matches has no rows to say how many it read; count what it was given
+        total_rows += int(rows[0]["num_rows"]) if rows else shard.rows
+        for row in rows:
+            fieldnames = fieldnames or list(row.keys())
+            key = (row["source_column_name"], row["edfi_column_name"])
+            if key not in merged:
+                merged[key] = (row, 0)
+            merged[key] = (merged[key][0], merged[key][1] + int(row["num_matches"]))
+
+    with open(dest_path, "w", newline="") as f:
+        if fieldnames is None:
+            # nothing matched anywhere; a single run leaves the file empty too
+            return
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        merged_rows = []
+        for row, num_matches in merged.values():
+            merged_rows.append({
+                **row,
+                "num_rows": total_rows,
+                "num_matches": num_matches,
+                "match_rate": num_matches / total_rows if total_rows else 0.0,
+            })
+        # best first, as Earthmover writes them
+        writer.writerows(sorted(merged_rows, key=lambda mr: mr["match_rate"], reverse=True))
+
+
+def merge_unmatched(paths, dest_path):
+    header = None
+    with open(dest_path, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                first_line = f.readline()
+                if header is None:
+                    header = first_line
+                    out.write(first_line)
+                elif first_line != header:
+                    out.write(first_line)
+                shutil.copyfileobj(f, out)
+
+
+def merge_results(shards, results_path, output_dir):
+    shard_results = []
+    for shard in shards:
+        with open(shard.results_path) as f:
+            shard_results.append(json.load(f))
+
+    merged = dict(shard_results[0])
+    row_counts = {}
+    for results in shard_results:
+        for key, count in results.get("row_counts", {}).items():
+            if key in row_counts and key.startswith("$sources.") and key != INPUT_SOURCE:
+                continue
+            row_counts[key] = row_counts.get(key, 0) + count
+    for key in row_counts:
+        dest_path = os.path.join(output_dir, key[len(DEST_PREFIX):] + ".jsonl")
+        if key.startswith(DEST_PREFIX) and os.path.isfile(dest_path):
+            with open(dest_path, "rb") as f:
+                row_counts[key] = sum(1 for line in f if line.strip())
+    merged["row_counts"] = row_counts
+    with open(results_path, "w") as f:
+        json.dump(merged, f)
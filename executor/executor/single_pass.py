@@ -0,0 +1,129 @@
+# Single-pass cross-year matching transforms an input once against the current-year and cross-year
+# rosters together, instead of once against each in turn.
+#
+# The two rosters are unioned into one file for Earthmover. Every current-year (ODS) record is kept,
+# and cross-year (EDU) records are only added for students the ODS doesn't already know, so each student
+# is matched by exactly one source's identity. The studentUniqueIds of the ODS students are the union's
+# source tags: once Earthmover has run, each output record is routed to the ODS-bound output set or to
+# the sideloaded one depending on whether its student is among them.
+
+import json
+import os
+
+from executor.roster import json_loads
+from executor.roster_cache import link_or_copy
+
+
+def student_unique_id(record):
+    """The studentUniqueId a roster or output record refers to, or None if it doesn't refer to a student"""
+    try:
+        return str(record["studentReference"]["studentUniqueId"])
+    except (KeyError, TypeError):
+        return None
+
+
+def union_rosters(ods_path, edu_path, dest_path):
+    """Write the ODS roster plus the EDU records of students not in it to dest_path
+
+    Returns the studentUniqueIds of the ODS roster's students and the number of EDU records added
+    """
+    ods_ids = set()
+    edu_records = 0
+    with open(dest_path, "wb") as dest:
+        with open(ods_path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                unique_id = student_unique_id(json_loads(line))
+                if unique_id is not None:
+                    ods_ids.add(unique_id)
+                dest.write(line if line.endswith(b"\n") else line + b"\n")
+        with open(edu_path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if student_unique_id(json_loads(line)) in ods_ids:
+                    continue
+                edu_records += 1
+                dest.write(line if line.endswith(b"\n") else line + b"\n")
+    return ods_ids, edu_records
+
+
+def split_output(output_dir, ods_dir, non_ods_dir, ods_ids):
+    """Route the output JSONL in output_dir between the ODS-bound and sideloaded output directories
+
+    Records of ODS students stay in output_dir, which becomes ods_dir; the rest move to non_ods_dir.
+    Records that don't refer to a student (e.g. assessment metadata) belong to both, as they would if
+    each set had come from its own pass. Other files, like the match rates, are linked into non_ods_dir
+    as well.
+
+    Returns, per output file name, the number of student records in each set
+    """
+    os.rename(output_dir, ods_dir)
+    os.mkdir(non_ods_dir)
+    counts = {}
+    for fname in sorted(os.listdir(ods_dir)):
+        if not fname.endswith(".jsonl"):
+            link_or_copy(os.path.join(ods_dir, fname), os.path.join(non_ods_dir, fname))
+            continue
+        ods_path = os.path.join(ods_dir, fname)
+        unsplit_path = f"{ods_path}.unsplit"
+        os.rename(ods_path, unsplit_path)
+        file_counts = {"ods": 0, "non_ods": 0}
+        with open(unsplit_path, "rb") as src, \
+                open(ods_path, "wb") as ods_out, \
+                open(os.path.join(non_ods_dir, fname), "wb") as non_ods_out:
+            for line in src:
+                if not line.strip():
+                    continue
+                unique_id = student_unique_id(json_loads(line))
+                if unique_id is None:
+                    ods_out.write(line)
+                    non_ods_out.write(line)
+                elif unique_id in ods_ids:
+                    file_counts["ods"] += 1
+                    ods_out.write(line)
+                else:
+                    file_counts["non_ods"] += 1
+                    non_ods_out.write(line)
+        os.remove(unsplit_path)
+        counts[fname[:-len(".jsonl")]] = file_counts
+    return counts
+
+
+def sideload_ods_students(ods_dir, non_ods_dir):
+    """Add the student records of the ODS-bound output to the sideloaded output too
+
+    This is what a cross-year pass over the whole input would have produced
+    """
+    for fname in list_jsonl(ods_dir):
+        with open(os.path.join(ods_dir, fname), "rb") as src, \
+                open(os.path.join(non_ods_dir, fname), "ab") as non_ods_out:
+            for line in src:
+                if line.strip() and student_unique_id(json_loads(line)) is not None:
+                    non_ods_out.write(line)
+
+
+def list_jsonl(local_dir):
+    return [fname for fname in sorted(os.listdir(local_dir)) if fname.endswith(".jsonl")]
+
+
+def count_lines(path):
+    """Number of non-blank lines in a JSONL file"""
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def write_split_results(em_results_path, dest_path, output_dir):
+    """Write a copy of an Earthmover results file whose destination row counts describe output_dir's files"""
+    with open(em_results_path) as f:
+        em_results = json.load(f)
+    dest_prefix = "$destinations."
+    row_counts = em_results.get("row_counts", {})
+    for key in row_counts:
+        if not key.startswith(dest_prefix):
+            continue
+        fpath = os.path.join(output_dir, key[len(dest_prefix):] + ".jsonl")
+        row_counts[key] = count_lines(fpath) if os.path.exists(fpath) else 0
+    with open(dest_path, "w") as f:
+        json.dump(em_results, f)
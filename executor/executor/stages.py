@@ -0,0 +1,92 @@
+# Stages let the executor run independent actions concurrently.
+#
+# Several of the executor's early actions (refreshing bundle code, fetching the roster, downloading
+# input files) are pure I/O and do not depend on one another. A Stage pairs one of those actions with
+# the function that performs it and the actions it has to wait for; run_stages() starts each stage as
+# soon as its dependencies have succeeded.
+
+import queue
+import threading
+
+
+class Stage:
+    def __init__(self, action, run, after=None):
+        # The action reported to the app while this stage runs
+        self.action = action
+        # Zero-argument callable that performs the stage's work
+        self.run = run
+        # Actions that must succeed before this stage may begin
+        self.after = list(after or [])
+        # The thread running this stage, once it has started
+        self.thread = None
+
+
+class StageFailure(Exception):
+    """The first stage to fail, along with the ExecutorError it produced"""
+    def __init__(self, stage, executor_error, exception):
+        super().__init__(f"stage {stage.action} failed: {repr(exception)}")
+        self.stage = stage
+        self.executor_error = executor_error
+        self.exception = exception
+
+
+def run_stages(stages, on_begin, on_success, get_error):
+    """Run stages concurrently, respecting their dependencies
+
+    on_begin and on_success are called with a stage's action as it starts and finishes. get_error is
+    called in a stage's own thread right after it raises, to capture the ExecutorError it recorded; it
+    must return that stage's error even if other stages fail at the same time. Once a stage fails, no
+    new stages are started; stages already in flight are allowed to finish and then StageFailure is
+    raised for the first failure. If the calling thread is interrupted instead (e.g. by a job timeout),
+    stages in flight are left running; each stage's thread is on the Stage so the caller can wait for it.
+    """
+    by_action = {s.action: s for s in stages}
+    for s in stages:
+        missing = [a for a in s.after if a not in by_action]
+        if missing:
+            raise ValueError(f"stage {s.action} depends on unknown stages: {missing}")
+
+    done = set()
+    pending = list(stages)
+    running = 0
+    failure = None
+    finished = queue.Queue()
+
+    def worker(stage):
+        try:
+            stage.run()
+        except BaseException as e:
+            finished.put((stage, e, get_error()))
+        else:
+            finished.put((stage, None, None))
+
+    def start_ready():
+        nonlocal running
+        for stage in [s for s in pending if all(a in done for a in s.after)]:
+            pending.remove(stage)
+            on_begin(stage.action)
+            # daemon threads so that a job timeout in the main thread is not held up by a stuck stage
+            stage.thread = threading.Thread(target=worker, args=(stage,), daemon=True, name=stage.action)
+            stage.thread.start()
+            running += 1
+
+    start_ready()
+    while running:
+        stage, exc, stage_error = finished.get()
+        running -= 1
+        if exc is not None:
+            if failure is None:
+                failure = StageFailure(stage, stage_error, exc)
+            continue
+
+        on_success(stage.action)
+        done.add(stage.action)
+        if failure is None:
+            start_ready()
+
+    if failure is not None:
+        raise failure
+
+    if pending:
+        # only reachable if the dependencies form a cycle
+        raise ValueError(f"stages could not be scheduled: {[s.action for s in pending]}")
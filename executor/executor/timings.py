@@ -0,0 +1,85 @@
+# Action timings measure what each of the executor's actions cost: wall time, CPU time, memory, and bytes
+# moved over the network.
+#
+# CPU time and peak RSS come from getrusage, so they cover the executor process and, separately, the child
+# processes (earthmover, lightbeam, git) that have exited so far. Peak RSS is a high-water mark for the
+# life of the process rather than a per-action figure, and a child's peak includes whatever of the
+# executor's memory it inherited when it was forked. Actions that run concurrently (see stages.py) each
+# see the CPU time of the whole process while they ran.
+
+import resource
+import threading
+import time
+
+
+def _usage():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_seconds": self_usage.ru_utime + self_usage.ru_stime,
+        "child_cpu_seconds": child_usage.ru_utime + child_usage.ru_stime,
+        # kilobytes on Linux
+        "peak_rss_kb": self_usage.ru_maxrss,
+        "child_peak_rss_kb": child_usage.ru_maxrss,
+    }
+
+
+class ActionTimings:
+    def __init__(self):
+        self.started_at = time.time()
+        # finished actions, in the order they finished
+        self.actions = []
+        # action -> (monotonic start, usage at start, bytes transferred so far)
+        self._open = {}
+        self._lock = threading.Lock()
+        # the action that bytes moved by the current thread are attributed to
+        self._local = threading.local()
+
+    def begin(self, action):
+        """Start measuring an action, and attribute the calling thread's transfers to it"""
+        with self._lock:
+            self._open[action] = [time.monotonic(), _usage(), 0]
+        self.attribute_to(action)
+
+    def attribute_to(self, action):
+        """Attribute bytes transferred by the calling thread to action"""
+        self._local.action = action
+
+    def add_bytes(self, num_bytes):
+        """Record bytes transferred by the calling thread's current action"""
+        action = getattr(self._local, "action", None)
+        with self._lock:
+            if action in self._open:
+                self._open[action][2] += num_bytes
+
+    def end(self, action, status):
+        """Stop measuring an action. Returns its metrics, or None if it was never begun"""
+        with self._lock:
+            opened = self._open.pop(action, None)
+        if opened is None:
+            return None
+
+        start, usage_at_start, num_bytes = opened
+        usage = _usage()
+        metrics = {
+            "wall_seconds": round(time.monotonic() - start, 3),
+            "cpu_seconds": round(usage["cpu_seconds"] - usage_at_start["cpu_seconds"], 3),
+            "child_cpu_seconds": round(usage["child_cpu_seconds"] - usage_at_start["child_cpu_seconds"], 3),
+            "peak_rss_kb": usage["peak_rss_kb"],
+            "child_peak_rss_kb": usage["child_peak_rss_kb"],
+            "bytes_transferred": num_bytes,
+        }
+        with self._lock:
+            self.actions.append({"action": action, "status": status, **metrics})
+        return metrics
+
+    def to_json(self, **extra):
+        """Everything measured for the job so far, plus any extra job-level values"""
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "wall_seconds": round(time.time() - self.started_at, 3),
+                "actions": list(self.actions),
+                **_usage(),
+                **extra,
+            }
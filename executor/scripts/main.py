@@ -1,4 +1,10 @@
+import os
+
 from executor import JobExecutor
 
 job = JobExecutor()
-job.execute()
\ No newline at end of file
+if os.environ.get("EXECUTOR_JOB_QUEUE"):
+    # worker mode: run queued jobs in this one warm process
+    job.work(os.environ["EXECUTOR_JOB_QUEUE"])
+else:
+    job.execute()
\ No newline at end of file
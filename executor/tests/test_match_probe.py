@@ -0,0 +1,50 @@
+import json
+
+import executor.match_probe as match_probe
+from executor.match_probe import candidate_columns, estimate_match_rate
+
+
+def write_roster(path, num_students):
+    with open(path, "w") as f:
+        for i in range(num_students):
+            f.write(json.dumps({
+                "studentReference": {"studentUniqueId": str(1000 + i)},
+                "studentIdentificationCodes": [{
+                    "studentIdentificationSystemDescriptor": "uri://ed-fi.org/StudentIdentificationSystemDescriptor#State",
+                    "identificationCode": f"S{i}",
+                }],
+            }) + "\n")
+
+
+def test_candidate_columns_skip_columns_of_phrases():
+    header = ["name", "state_id", "score"]
+    rows = [["Ada Lovelace", "S1", "5"], ["Alan Turing", "S2", "6"]]
+    assert candidate_columns(header, rows) == [1, 2]
+
+
+def test_candidate_columns_prefer_named_id_columns():
+    header = ["name", "state_id", "score"]
+    rows = [["Ada Lovelace", "S1", "5"]]
+    assert candidate_columns(header, rows, ["local_id", "state_id"]) == [1]
+    assert candidate_columns(header, rows, ["local_id"]) == [1, 2]
+
+
+def test_estimate_keeps_the_roster_prefilter_with_a_name_column(tmp_path, monkeypatch):
+    roster = tmp_path / "roster.jsonl"
+    write_roster(roster, 1000)
+    input_path = tmp_path / "input.csv"
+    with open(input_path, "w", newline="") as f:
+        f.write("name,state_id\r\n")
+        for i in range(200):
+            f.write(f"Student Number {i},S{i}\r\n")
+
+    parsed = []
+    def counting_loads(line):
+        parsed.append(line)
+        return json.loads(line)
+    monkeypatch.setattr(match_probe, "json_loads", counting_loads)
+
+    estimate = estimate_match_rate(str(roster), str(input_path), "utf-8", 5000)
+    assert (estimate.column, estimate.id_type, estimate.match_rate) == ("state_id", "State", 1.0)
+    # only the lines of the sampled students were parsed
+    assert len(parsed) == 200
@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+import os
+
+from executor.shards import (
+    Shard, input_header_rows, merge_match_rates, merge_results, merge_unmatched, records,
+)
+
+MATCH_RATES = "student_id_match_rates.csv"
+FIELDS = ["source_column_name", "edfi_column_name", "num_matches", "num_rows", "match_rate"]
+
+
+def make_shard(tmp_path, index, rows=0):
+    shard = Shard(str(tmp_path / "shards"), index, ".csv")
+    shard.rows = rows
+    return shard
+
+
+def write_match_rates(shard, rows):
+    with open(shard.output_path(MATCH_RATES), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_match_rates(path):
+    with open(path) as f:
+        return list(csv.DictReader(f))
+
+
+def test_records_keeps_quoted_line_breaks_in_one_record():
+    text = 'id,note\r\n1,"two\r\nlines"\r\n2,"say ""hi"""\r\n3,plain'
+    assert list(records(io.StringIO(text, newline=""))) == [
+        "id,note\r\n",
+        '1,"two\r\nlines"\r\n',
+        '2,"say ""hi"""\r\n',
+        "3,plain",
+    ]
+
+
+def test_records_yields_an_unterminated_quote_at_the_end():
+    assert list(records(io.StringIO('a\n"open\nnever closed\n'))) == ["a\n", '"open\nnever closed\n']
+
+
+def test_merge_match_rates_retotals_per_column_and_id_type(tmp_path):
+    first, second = make_shard(tmp_path, 0, 10), make_shard(tmp_path, 1, 30)
+    write_match_rates(first, [
+        {"source_column_name": "sid", "edfi_column_name": "State", "num_matches": 8, "num_rows": 10, "match_rate": 0.8},
+        {"source_column_name": "lid", "edfi_column_name": "Local", "num_matches": 1, "num_rows": 10, "match_rate": 0.1},
+    ])
+    write_match_rates(second, [
+        {"source_column_name": "sid", "edfi_column_name": "State", "num_matches": 30, "num_rows": 30, "match_rate": 1.0},
+    ])
+    dest = tmp_path / "merged.csv"
+    merge_match_rates([first, second], dest)
+
+    rows = read_match_rates(dest)
+    assert [(r["source_column_name"], r["edfi_column_name"]) for r in rows] == [("sid", "State"), ("lid", "Local")]
+    assert rows[0]["num_matches"] == "38" and rows[0]["num_rows"] == "40"
+    assert float(rows[0]["match_rate"]) == 38 / 40
+    assert rows[1]["num_matches"] == "1" and float(rows[1]["match_rate"]) == 1 / 40
+
+
+def test_merge_match_rates_counts_rows_of_shards_without_matches(tmp_path):
+    first, second = make_shard(tmp_path, 0, 10), make_shard(tmp_path, 1, 10)
+    write_match_rates(first, [
+        {"source_column_name": "sid", "edfi_column_name": "State", "num_matches": 5, "num_rows": 10, "match_rate": 0.5},
+    ])
+    dest = tmp_path / "merged.csv"
+    merge_match_rates([first, second], dest)
+
+    [row] = read_match_rates(dest)
+    assert row["num_rows"] == "20" and float(row["match_rate"]) == 0.25
+
+
+def test_merge_match_rates_leaves_the_file_empty_when_nothing_matched(tmp_path):
+    dest = tmp_path / "merged.csv"
+    merge_match_rates([make_shard(tmp_path, 0, 5), make_shard(tmp_path, 1, 5)], dest)
+    assert dest.read_text() == ""
+
+
+def test_merge_unmatched_keeps_the_first_header_only(tmp_path):
+    paths = []
+    for i, body in enumerate([b"sid,score\n1,5\n", b"sid,score\n2,6\n3,7\n", b"sid,score\n"]):
+        path = tmp_path / f"unmatched{i}.csv"
+        path.write_bytes(body)
+        paths.append(path)
+    dest = tmp_path / "merged.csv"
+    merge_unmatched(paths, dest)
+    assert dest.read_bytes() == b"sid,score\n1,5\n2,6\n3,7\n"
+
+
+def test_merge_results_sums_input_counts_and_recounts_destinations(tmp_path):
+    first, second = make_shard(tmp_path, 0), make_shard(tmp_path, 1)
+    for shard, input_rows in [(first, 3), (second, 4)]:
+        with open(shard.results_path, "w") as f:
+            json.dump({"started_at": f"shard {shard.index}", "row_counts": {
+                "$sources.input": input_rows,
+                "$sources.seed": 100,
+                "$transformations.students": input_rows,
+                "$destinations.studentAssessments": input_rows,
+            }}, f)
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    (output_dir / "studentAssessments.jsonl").write_text('{"a": 1}\n\n{"a": 2}\n')
+    results_path = tmp_path / "em-results.json"
+    merge_results([first, second], results_path, str(output_dir))
+
+    merged = json.loads(results_path.read_text())
+    assert merged["started_at"] == "shard 0"
+    assert merged["row_counts"] == {
+        "$sources.input": 7,
+        "$sources.seed": 100,
+        "$transformations.students": 7,
+        "$destinations.studentAssessments": 2,
+    }
+
+
+def test_input_header_rows(tmp_path):
+    wrapper, bundle = tmp_path / "wrapper.yaml", tmp_path / "bundle.yaml"
+    paths = [str(wrapper), str(bundle)]
+
+    bundle.write_text("sources:\n  input:\n    file: ${INPUT_FILE}\n")
+    assert input_header_rows(paths) == 1
+    bundle.write_text("sources:\n  input:\n    file: ${INPUT_FILE}\n    header_rows: 2\n")
+    assert input_header_rows(paths) == 2
+    wrapper.write_text("sources:\n  input:\n    header_rows: 1\n")
+    assert input_header_rows(paths) == 1
+    os.remove(wrapper)
+    bundle.write_text("sources:\n  input:\n    header_rows: 0\n    columns: [a, b]\n")
+    assert input_header_rows(paths) is None
+    bundle.write_text("{% set x = 1 %}\nsources: {}\n")
+    assert input_header_rows(paths) is None
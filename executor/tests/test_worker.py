@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+import executor.config as config
+from executor.executor import JobExecutor
+
+CREDENTIALS = [
+    {"AWS_ACCESS_KEY_ID": "AKIAFIRSTJOB", "AWS_SECRET_ACCESS_KEY": "first-secret", "AWS_SESSION_TOKEN": "first-token"},
+    {"AWS_ACCESS_KEY_ID": "AKIASECONDJOB", "AWS_SECRET_ACCESS_KEY": "second-secret", "AWS_SESSION_TOKEN": "second-token"},
+]
+
+
+@pytest.fixture
+def job_executor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN", "AWS_PROFILE"]:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("TIMEOUT_SECONDS", "60")
+    environ = dict(os.environ)
+    job_executor = JobExecutor()
+    yield job_executor
+    # reset_job_state() replaces the whole environment
+    os.environ.clear()
+    os.environ.update(environ)
+
+
+def test_worker_gives_each_job_its_own_s3_credentials(job_executor, tmp_path, monkeypatch):
+    queue_dir = tmp_path / "queue"
+    queue_dir.mkdir()
+    for i, credentials in enumerate(CREDENTIALS):
+        path = queue_dir / f"job{i}.json"
+        path.write_text(json.dumps({"TIMEOUT_SECONDS": 60, **credentials}))
+        # claimed oldest first
+        os.utime(path, (i, i))
+    monkeypatch.setattr(config, "WORKER_POLL_SECONDS", 0)
+    monkeypatch.setattr(config, "WORKER_MAX_IDLE_SECONDS", 0.5)
+
+    seen = []
+    def execute():
+        s3_credentials = job_executor.s3._request_signer._credentials.get_frozen_credentials()
+        seen.append({
+            "AWS_ACCESS_KEY_ID": s3_credentials.access_key,
+            "AWS_SECRET_ACCESS_KEY": s3_credentials.secret_key,
+            "AWS_SESSION_TOKEN": s3_credentials.token,
+        })
+    monkeypatch.setattr(job_executor, "execute", execute)
+
+    job_executor.work(str(queue_dir))
+    assert seen == CREDENTIALS
+
+
+def test_reset_job_state_forgets_the_previous_job(job_executor):
+    job_executor.unpack_job({
+        "appUrls": {
+            "status": "http://app/status", "error": "http://app/error", "unmatchedIds": "http://app/ids",
+            "summary": "http://app/summary", "outputFiles": "http://app/output",
+        },
+        "sendToOds": False,
+        "rosterFilePath": "s3://bucket/roster.jsonl",
+        "bundle": {"path": "assessments/BENCH", "branch": "main"},
+        "appDataBasePath": "s3://bucket/run/1",
+        "inputFiles": {"INPUT_FILE": {"path": "input.csv"}},
+        "customDescriptorMappings": {},
+        "inputParams": {"API_YEAR": 2026},
+    })
+    job_executor.num_unmatched_students = 3
+    job_executor.bundle_commit = "abc123"
+
+    job_executor.reset_job_state({"TIMEOUT_SECONDS": "60"})
+    for name in [
+        "status_url", "error_url", "matches_url", "summary_url", "output_files_url",
+        "send_to_ods", "s3_out_path", "num_unmatched_students", "bundle_commit",
+    ]:
+        assert getattr(job_executor, name) is None, name
+    assert job_executor.output_sets == []